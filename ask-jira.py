@@ -2,19 +2,16 @@
 
 from __future__ import print_function
 
+import os
 import sys
 import pprint
 import argparse
 import inspect
-from jira.client import JIRA
 
-from lib import timetracking
-from lib import subissues
-from lib import export_import
-from lib import google_calendar
 from utils.smart_argparse_formatter import SmartFormatter
 
-import jiraconfig as conf
+# Command modules, the JIRA client and the configuration are imported only
+# when a command runs to keep startup and help output fast.
 
 # helpers
 
@@ -29,6 +26,51 @@ def _make_jql_and_optional_portfolio_epics_argument_parser(parser):
     return parser
 
 
+def _make_export_import_argument_parser(parser):
+    parser = _make_jql_and_optional_portfolio_epics_argument_parser(parser)
+    parser.add_argument("--workers", type=int, default=1, help="number of "
+            "top-level issues to export/import in parallel (default: 1)")
+    parser.add_argument("--journal", metavar="FILE", help="journal file for "
+            "recording completed steps, an interrupted export/import is "
+            "resumed from it when run again")
+    parser.add_argument("--bulk-create", action="store_true", help="create "
+            "top-level issues in batches of 50 with the bulk create API")
+    parser.add_argument("--plan", action="store_true", help="only count the "
+            "issues, comments, worklogs and attachments that would be "
+            "exported/imported and estimate the number of API calls")
+    return parser
+
+
+def _make_concurrency_argument_parser(parser):
+    from lib import fanout
+    parser.add_argument("--concurrency", type=int,
+            default=fanout.DEFAULT_CONCURRENCY, help="maximum number of "
+            "read requests in flight together (default: %(default)s)")
+    return parser
+
+
+def _make_jql_and_concurrency_argument_parser(parser):
+    parser = _make_jql_argument_parser(parser)
+    return _make_concurrency_argument_parser(parser)
+
+
+def _make_timetracking_argument_parser(parser):
+    from lib import timetracking
+    parser = _make_jql_and_concurrency_argument_parser(parser)
+    parser.add_argument("--group-by", choices=timetracking.GROUP_BY_CHOICES,
+            help="sum time tracking fields separately for each group")
+    return parser
+
+
+def _make_subissues_argument_parser(parser):
+    from lib import subissues
+    parser = _make_jql_and_concurrency_argument_parser(parser)
+    parser.add_argument("--format", choices=subissues.FORMATS, default='markdown',
+            help="output format, json and ndjson print one epic tree "
+            "with its stories and subtasks per element (default: markdown)")
+    return parser
+
+
 def _make_transitions_argument_parser(parser):
     parser.add_argument("issue", help="the JIRA issue key used in the command")
     return parser
@@ -38,14 +80,20 @@ def _make_transitions_argument_parser(parser):
 
 def projects(jira, args):
     """List available JIRA projects"""
+    from lib import metadata
     print("Available JIRA projects:")
-    pprint.pprint([project.name for project in jira.projects()])
+    pprint.pprint([project.name for project in metadata.get_projects(jira)])
+
+projects.cacheable = True
 
 
 def fields(jira, args):
     """List available JIRA field names and IDs"""
+    from lib import metadata
     print("Available JIRA fields (name, id):")
-    pprint.pprint([(field['name'], field['id']) for field in jira.fields()])
+    pprint.pprint([(field['name'], field['id']) for field in metadata.get_fields(jira)])
+
+fields.cacheable = True
 
 
 def transitions(jira, args):
@@ -54,44 +102,67 @@ def transitions(jira, args):
     pprint.pprint(jira.transitions(args.issue))
 
 transitions.argparser = _make_transitions_argument_parser
+transitions.cacheable = True
 
 
 def sum_timetracking_for_jql(jira, args):
     """Sum original estimate, time spent
     and time remaining for all issues that match the given JQL query"""
-    results = timetracking.sum_timetracking_for_jql(jira, args.jql)
+    from lib import fanout
+    from lib import timetracking
+    fanout.configure(jira, args.concurrency)
+    results = timetracking.sum_timetracking_for_jql(jira, args.jql, args.group_by,
+            args.concurrency)
     pprint.pprint(results)
 
-sum_timetracking_for_jql.argparser = _make_jql_argument_parser
+sum_timetracking_for_jql.argparser = _make_timetracking_argument_parser
+sum_timetracking_for_jql.cacheable = True
 
 
 def list_epics_stories_and_tasks_for_jql(jira, args):
-    """Print a Markdown-compatible tree of epics,
+    """Print a Markdown-compatible or JSON tree of epics,
     stories and subtasks that match the given JQL query"""
-    results = subissues.list_epics_stories_and_tasks(jira, args.jql)
-    print(results)
+    from lib import fanout
+    from lib import subissues
+    fanout.configure(jira, args.concurrency)
+    for result in subissues.list_epics_stories_and_tasks(jira, args.jql,
+            args.concurrency, args.format):
+        print(result, flush=True)
 
-list_epics_stories_and_tasks_for_jql.argparser = _make_jql_argument_parser
+list_epics_stories_and_tasks_for_jql.argparser = _make_subissues_argument_parser
+list_epics_stories_and_tasks_for_jql.cacheable = True
 
 
 def export_import_issues_for_jql(jira, args):
     """Export issues from one JIRA instance
     to another with comments and attachments"""
+    from lib import export_import
     import exportimportconfig
+    if args.plan:
+        plan = export_import.plan_export_import(jira, exportimportconfig,
+                args.jql, args.portfolio_epics, args.bulk_create)
+        pprint.pprint(plan)
+        return
     exported_issues = export_import.export_import_issues(jira,
-            exportimportconfig, args.jql, args.portfolio_epics)
+            exportimportconfig, args.jql, args.portfolio_epics, args.workers,
+            args.journal, args.bulk_create)
     if exported_issues:
         print('Successfully imported', exported_issues)
 
-export_import_issues_for_jql.argparser = _make_jql_and_optional_portfolio_epics_argument_parser
+export_import_issues_for_jql.argparser = _make_export_import_argument_parser
 
 
 def import_worklogs_from_google_calendar(jira, args):
     """Import worklog entries from Google Calendar
     to corresponding JIRA tasks"""
+    from lib import fanout
+    from lib import google_calendar
+    import jiraconfig as conf
     import worklogconfig
+    fanout.configure(jira, max(args.concurrency, args.workers))
     hours = google_calendar.import_worklogs(jira, conf.JIRA['user'],
-            worklogconfig, args.calendar, args.fromdate, args.todate)
+            worklogconfig, args.calendar, args.fromdate, args.todate,
+            args.concurrency, args.incremental, args.workers)
     print('Logged', hours, 'hours')
 
 
@@ -102,18 +173,82 @@ def _import_worklogs_argument_parser(parser):
             "in yyyy-mm-dd format")
     parser.add_argument("todate", help="import date range end, "
             "in yyyy-mm-dd format")
-    return parser
+    parser.add_argument("--incremental", action="store_true",
+            help="fetch only the events changed since the previous "
+            "incremental import of the calendar")
+    parser.add_argument("--workers", type=int, default=1, help="number of "
+            "issues to submit worklogs to in parallel (default: 1)")
+    return _make_concurrency_argument_parser(parser)
 
 import_worklogs_from_google_calendar.argparser = _import_worklogs_argument_parser
 
 
+def daemon(jira, args):
+    """Run commands sent by clients over a Unix domain socket
+    with warm JIRA sessions, set ASK_JIRA_SOCKET in clients to use it"""
+    from lib import command_server
+    # Clients are kept per response cache mode for the life of the daemon,
+    # together with their fields and projects, see lib/metadata.py.
+    clients = {(False, False): jira}
+    prog = sys.argv[0]
+
+    def run_command(argv):
+        sys.argv = [prog] + argv
+        command_name, command = _get_command()
+        if command is daemon:
+            raise RuntimeError("The daemon cannot run the 'daemon' command")
+        command_args = _parse_command_specific_arguments(command_name, command)
+        cached = _uses_cache(command, command_args)
+        client_key = (cached, cached and command_args.refresh)
+        if client_key not in clients:
+            clients[client_key] = _configure_jira(server_info_client=jira)
+            _configure_cache(clients[client_key], command_args)
+        _run_command(command, clients[client_key], command_args)
+
+    command_server.serve(args.socket, run_command)
+
+
+def _make_daemon_argument_parser(parser):
+    parser.add_argument("--socket",
+            default=os.environ.get('ASK_JIRA_SOCKET', '~/.ask-jira.sock'),
+            help="the Unix domain socket to listen on (default: %(default)s)")
+    return parser
+
+daemon.argparser = _make_daemon_argument_parser
+
+
 # main
 
 def _main():
+    if 'ASK_JIRA_SOCKET' in os.environ and sys.argv[1:2] != ['daemon']:
+        _forward_to_daemon()
     command_name, command = _get_command()
     args = _parse_command_specific_arguments(command_name, command)
     jira = _configure_jira()
-    command(jira, args)
+    if _uses_cache(command, args):
+        _configure_cache(jira, args)
+    _run_command(command, jira, args)
+
+
+def _run_command(command, jira, args):
+    if not args.profile and not args.profile_json:
+        command(jira, args)
+        return
+    from lib import profiling
+    profiler = profiling.start()
+    try:
+        command(jira, args)
+    finally:
+        profiling.stop()
+        profiler.print_report(json_file=args.profile_json)
+
+
+def _forward_to_daemon():
+    from lib import command_server
+    status = command_server.forward(os.environ['ASK_JIRA_SOCKET'], sys.argv[1:])
+    # Run the command locally if the daemon is not running.
+    if status is not None:
+        sys.exit(status)
 
 
 # helpers
@@ -152,22 +287,61 @@ def _list_local_commands():
 
 
 def _parse_command_specific_arguments(command_name, command):
-    if not hasattr(command, 'argparser'):
-        return None
     parser = argparse.ArgumentParser()
     parser.add_argument("command", help=command_name)
-    command_argparser = command.argparser(parser)
-    return command_argparser.parse_args()
-
-def _configure_jira():
+    parser.add_argument("--profile", action="store_true",
+            help="print HTTP call counts, latencies and bytes per endpoint "
+            "to stderr when the command finishes")
+    parser.add_argument("--profile-json", metavar="FILE",
+            help="profile like --profile and write the report as JSON to FILE")
+    if getattr(command, 'cacheable', False):
+        parser.add_argument("--no-cache", action="store_true",
+                help="do not use the response cache")
+        parser.add_argument("--refresh", action="store_true",
+                help="ignore cached responses and refresh the cache")
+    if hasattr(command, 'argparser'):
+        parser = command.argparser(parser)
+    return parser.parse_args()
+
+def _configure_jira(server_info_client=None):
+    from jira.client import JIRA
+    from lib import profiling
+    from lib import throttling
+    import jiraconfig as conf
     # Add 'verify': False if HTTPS cert is untrusted.
     options = {'server': conf.JIRA['server']}
+    # Clients of the same server can reuse the server info of another client.
+    get_server_info = server_info_client is None
     if 'password' in conf.JIRA:
-        return JIRA(options, basic_auth=(conf.JIRA['user'], conf.JIRA['password']))
+        jira = JIRA(options, basic_auth=(conf.JIRA['user'], conf.JIRA['password']),
+                    get_server_info=get_server_info)
     elif 'access-token' in conf.JIRA:
-        return JIRA(options, token_auth=conf.JIRA['access-token'])
+        jira = JIRA(options, token_auth=conf.JIRA['access-token'],
+                    get_server_info=get_server_info)
     else:
         raise RuntimeError("Configuration does not contain either password or access-token.")
+    if server_info_client is not None:
+        jira._version = server_info_client._version
+        jira.deploymentType = server_info_client.deploymentType
+    throttling.configure(jira, conf.JIRA)
+    profiling.install(jira._session)
+    return jira
+
+
+def _uses_cache(command, args):
+    import jiraconfig as conf
+    return (getattr(command, 'cacheable', False) and not args.no_cache
+            and bool(getattr(conf, 'CACHE', None)))
+
+
+def _configure_cache(jira, args):
+    from lib import http_cache
+    import jiraconfig as conf
+    cache_conf = conf.CACHE
+    cache = http_cache.ResponseCache(cache_conf['directory'],
+            cache_conf.get('max-size', http_cache.DEFAULT_MAX_SIZE),
+            cache_conf.get('ttl'), args.refresh)
+    cache.install(jira._session)
 
 
 if __name__ == "__main__":
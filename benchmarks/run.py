@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Runs ask-jira commands against the in-process stub JIRA and Calendar server
+and reports wall time, throughput, request counts and peak memory per
+command. Fails when a result regresses beyond the stored baseline. Each
+command runs in its own process, peak memory is the growth of the peak
+resident set size while the command runs.
+
+    $ python benchmarks/run.py [--scenario NAME] [--update-baseline]
+
+For a dataset of about 10k issues use
+--epics 100 --stories-per-epic 20 --subtasks-per-story 4.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from jira.client import JIRA
+
+import stub_server
+
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+# Absolute slack on top of the relative tolerances so that noise in short
+# runs is not reported as a regression.
+TIME_SLACK = 0.05
+MEMORY_SLACK = 4 * 1024 * 1024
+
+SCENARIOS = collections.OrderedDict()
+
+def _scenario(name):
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+
+@_scenario('sum_timetracking_for_jql')
+def _sum_timetracking(source, dest, args):
+    from lib import timetracking
+    timetracking.sum_timetracking_for_jql(_connect(source), 'project = SRC', 'assignee',
+                                          args.concurrency)
+    return len(source.dataset)
+
+
+@_scenario('list_epics_stories_and_tasks_for_jql')
+def _list_epics_stories_and_tasks(source, dest, args):
+    from lib import subissues
+    for result in subissues.list_epics_stories_and_tasks(_connect(source),
+            'project = SRC and type = Epic', args.concurrency):
+        print(result)
+    return len(source.dataset)
+
+
+@_scenario('export_import_issues_for_jql')
+def _export_import_issues(source, dest, args):
+    from lib import export_import
+    return len(export_import.export_import_issues(_connect(source), _get_export_import_conf(dest),
+            'project = SRC and type = Story', workers=args.workers))
+
+
+@_scenario('export_import_issues_for_jql_plan')
+def _plan_export_import(source, dest, args):
+    from lib import export_import
+    plan = export_import.plan_export_import(_connect(source), _get_export_import_conf(dest),
+            'project = SRC and type = Story')
+    print(plan)
+    return plan['issues'] + plan['subtasks']
+
+
+def _get_export_import_conf(dest):
+    conf = SimpleNamespace(**runpy.run_path(os.path.join(ROOT_DIR, 'exportimportconfig-sample.py')))
+    conf.JIRA = {'server': dest.url, 'user': stub_server.USER, 'password': stub_server.USER,
+                 'project': dest.dataset.project}
+    conf.CUSTOM_FIELD = None
+    conf.CUSTOM_FIELD_MAP = {}
+    conf.CUSTOM_FIELD_FOR_SOURCE_JIRA_ISSUE_KEY = stub_server.SOURCE_KEY_FIELD
+    conf.SOURCE_EPIC_LINK_FIELD_ID = stub_server.EPIC_LINK_FIELD_ID
+    conf.SOURCE_EPIC_NAME_FIELD_ID = stub_server.EPIC_NAME_FIELD_ID
+    return conf
+
+
+@_scenario('import_worklogs_from_google_calendar')
+def _import_worklogs(source, dest, args):
+    import httplib2
+    from googleapiclient.discovery import build
+    from lib import google_calendar
+    conf = SimpleNamespace(TIMEZONE='+00:00', JIRA_TIMEZONE=None, WORKLOG_PREFIX_FILTER=None,
+                           CALENDAR_ID_TTL=0)
+    get_calendar_service = google_calendar._get_calendar_service
+    # The stub serves the Calendar API without OAuth.
+    google_calendar._get_calendar_service = lambda conf: build('calendar', 'v3',
+            http=httplib2.Http(), static_discovery=True,
+            client_options={'api_endpoint': source.url + '/calendar/v3/'})
+    try:
+        google_calendar.import_worklogs(_connect(source), stub_server.USER, conf,
+                stub_server.CALENDAR_NAME, '2024-01-01', '2099-01-01', args.concurrency,
+                workers=args.workers)
+    finally:
+        google_calendar._get_calendar_service = get_calendar_service
+    return len(source.dataset.events)
+
+
+def _connect(server):
+    return JIRA({'server': server.url}, basic_auth=(stub_server.USER, stub_server.USER))
+
+
+def _run_scenario(name, args):
+    dataset = stub_server.Dataset(args.epics, args.stories_per_epic, args.subtasks_per_story,
+            args.comments, args.worklogs, args.attachments, args.attachment_size, args.events)
+    latency = args.latency / 1000.0
+    source = stub_server.StubServer(dataset, latency).start()
+    dest = stub_server.StubServer(latency=latency).start()
+    try:
+        start_memory = _get_peak_memory()
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            items = SCENARIOS[name](source, dest, args)
+        seconds = time.perf_counter() - start
+        peak_memory = _get_peak_memory() - start_memory
+    finally:
+        source.stop()
+        dest.stop()
+    return {
+        'seconds': round(seconds, 3),
+        'items': items,
+        'items per second': round(items / seconds, 1),
+        'requests': sum(source.request_counts.values()) + sum(dest.request_counts.values()),
+        'peak memory': peak_memory,
+    }
+
+
+def _get_peak_memory():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _run_scenario_process(name, args):
+    command = [sys.executable, os.path.abspath(__file__), '--run-scenario', name]
+    for setting, value in _get_settings(args).items():
+        command += ['--' + setting.replace('_', '-'), str(value)]
+    return json.loads(subprocess.check_output(command, universal_newlines=True))
+
+
+def _get_settings(args):
+    return dict((name, getattr(args, name)) for name in (
+        'epics', 'stories_per_epic', 'subtasks_per_story', 'comments', 'worklogs',
+        'attachments', 'attachment_size', 'events', 'latency', 'workers', 'concurrency'))
+
+
+def _find_regressions(results, baseline, args):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['seconds'] > base['seconds'] * (1 + args.time_tolerance) + TIME_SLACK:
+            regressions.append('%s: %.3fs, baseline %.3fs' % (name, result['seconds'], base['seconds']))
+        if result['requests'] > base['requests'] * (1 + args.requests_tolerance):
+            regressions.append('%s: %d requests, baseline %d' % (name, result['requests'], base['requests']))
+        if result['peak memory'] > base['peak memory'] * (1 + args.memory_tolerance) + MEMORY_SLACK:
+            regressions.append('%s: peak memory %d bytes, baseline %d' %
+                               (name, result['peak memory'], base['peak memory']))
+    return regressions
+
+
+def _print_results(results):
+    print('%-40s %9s %7s %10s %9s %12s' % ('command', 'seconds', 'items', 'items/s',
+                                            'requests', 'peak MiB'))
+    for name, result in results.items():
+        print('%-40s %9.3f %7d %10.1f %9d %12.1f' % (name, result['seconds'], result['items'],
+                result['items per second'], result['requests'],
+                result['peak memory'] / 1024.0 / 1024.0))
+
+
+def _make_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='command to benchmark, can be repeated (default: all)')
+    parser.add_argument('--epics', type=int, default=10)
+    parser.add_argument('--stories-per-epic', type=int, default=10)
+    parser.add_argument('--subtasks-per-story', type=int, default=2)
+    parser.add_argument('--comments', type=int, default=2, help='comments per issue')
+    parser.add_argument('--worklogs', type=int, default=2, help='worklogs per issue')
+    parser.add_argument('--attachments', type=int, default=1, help='attachments per issue')
+    parser.add_argument('--attachment-size', type=int, default=256 * 1024, help='bytes')
+    parser.add_argument('--events', type=int, default=200, help='calendar events')
+    parser.add_argument('--latency', type=float, default=2.0,
+                        help='stub server latency per request in milliseconds')
+    parser.add_argument('--workers', type=int, default=4, help='export/import and worklog submission workers')
+    parser.add_argument('--concurrency', type=int, default=4, help='read request concurrency')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='baseline file (default: benchmarks/baseline.json)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--time-tolerance', type=float, default=0.25,
+                        help='allowed relative increase of wall time (default: 0.25)')
+    parser.add_argument('--requests-tolerance', type=float, default=0.01,
+                        help='allowed relative increase of the request count, concurrent '
+                        'workers may repeat a few lookups (default: 0.01)')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                        help='allowed relative increase of peak memory (default: 0.25)')
+    parser.add_argument('--run-scenario', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    return parser
+
+
+def _main():
+    args = _make_argument_parser().parse_args()
+    if args.run_scenario:
+        print(json.dumps(_run_scenario(args.run_scenario, args)))
+        return 0
+    settings = _get_settings(args)
+    results = collections.OrderedDict((name, _run_scenario_process(name, args))
+                                      for name in args.scenario or SCENARIOS)
+    _print_results(results)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    if args.update_baseline:
+        if baseline and baseline['settings'] == settings:
+            baseline['results'].update(results)
+        else:
+            baseline = {'settings': settings, 'results': results}
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print('Stored baseline in', args.baseline)
+        return 0
+    if not baseline:
+        print('No baseline in', args.baseline, 'to compare with')
+        return 0
+    if baseline['settings'] != settings:
+        print('Baseline was recorded with different settings, not comparing')
+        return 0
+
+    regressions = _find_regressions(results, baseline['results'], args)
+    for regression in regressions:
+        print('REGRESSION:', regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Guards the startup time of ask-jira.py: checks that printing the help does
+not import the JIRA client, Google API client or command modules and that
+the median startup time stays under the given limit.
+
+    $ python benchmarks/startup.py [--runs 10] [--max-seconds 0.5]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ASK_JIRA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'ask-jira.py')
+
+# Modules that only the commands that need them may import.
+HEAVY_MODULES = (
+    'jira',
+    'requests',
+    'googleapiclient',
+    'google_auth_oauthlib',
+    'pytz',
+    'dateutil',
+    'keyring',
+    'jiraconfig',
+    'lib.export_import',
+    'lib.google_calendar',
+    'lib.subissues',
+    'lib.timetracking',
+)
+
+_LIST_IMPORTED_MODULES = """
+import importlib.util, sys
+sys.path.insert(0, {directory!r})
+spec = importlib.util.spec_from_file_location('ask_jira', {path!r})
+ask_jira = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ask_jira)
+ask_jira._list_local_commands()
+print('\\n'.join(sys.modules))
+"""
+
+
+def _get_heavy_imports():
+    code = _LIST_IMPORTED_MODULES.format(directory=os.path.dirname(ASK_JIRA), path=ASK_JIRA)
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    return sorted(module for module in output.split()
+                  if module.split('.')[0] in HEAVY_MODULES or module in HEAVY_MODULES)
+
+
+def _time_help(runs):
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.call([sys.executable, ASK_JIRA], stdout=devnull, stderr=devnull)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10, help='number of runs (default: 10)')
+    parser.add_argument('--max-seconds', type=float, default=0.5,
+                        help='maximum median startup time (default: 0.5)')
+    args = parser.parse_args()
+
+    heavy_imports = _get_heavy_imports()
+    if heavy_imports:
+        print('Help output imports', ', '.join(heavy_imports), file=sys.stderr)
+        return 1
+
+    timings = _time_help(args.runs)
+    median = statistics.median(timings)
+    print('Startup time over %d runs: median %.3fs, min %.3fs, max %.3fs'
+          % (args.runs, median, min(timings), max(timings)))
+    if median > args.max_seconds:
+        print('Median startup time exceeds %.3fs' % args.max_seconds, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,493 @@
+"""
+In-process stub of the JIRA REST endpoints and the Google Calendar events
+API used by ask-jira, serving a generated dataset with configurable latency.
+"""
+
+from __future__ import print_function
+
+import collections
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+EPIC_LINK_FIELD_ID = 'customfield_10251'
+EPIC_NAME_FIELD_ID = 'customfield_10252'
+SPRINT_FIELD_ID = 'customfield_10253'
+SOURCE_KEY_FIELD = ('Text 1', 'customfield_10132')
+
+FIELDS = [
+    {'id': EPIC_LINK_FIELD_ID, 'name': 'Epic Link', 'clauseNames': ['cf[10251]', 'Epic Link']},
+    {'id': EPIC_NAME_FIELD_ID, 'name': 'Epic Name', 'clauseNames': ['cf[10252]', 'Epic Name']},
+    {'id': SPRINT_FIELD_ID, 'name': 'Sprint', 'clauseNames': ['cf[10253]', 'Sprint']},
+    {'id': SOURCE_KEY_FIELD[1], 'name': SOURCE_KEY_FIELD[0], 'clauseNames': ['cf[10132]']},
+    {'id': 'summary', 'name': 'Summary', 'clauseNames': ['summary']},
+    {'id': 'description', 'name': 'Description', 'clauseNames': ['description']},
+]
+
+TRANSITIONS = ['Start work', 'Work done', 'Review passed', 'Testing passed',
+               'In Progress', 'Done']
+
+CALENDAR_ID = 'benchmark'
+CALENDAR_NAME = 'Work'
+USER = 'bench'
+
+# Number of worklogs that JIRA includes in the issue fields.
+ISSUE_WORKLOG_PAGE_SIZE = 20
+MAX_SEARCH_RESULTS = 1000
+CALENDAR_PAGE_SIZE = 250
+
+
+class Dataset(object):
+    """
+    Issues of a source project: epics with stories with subtasks, each with
+    comments, worklogs and attachments, and calendar events that log work
+    on the stories.
+    """
+
+    def __init__(self, epics=20, stories_per_epic=10, subtasks_per_story=2,
+                 comments_per_issue=2, worklogs_per_issue=2, attachments_per_issue=0,
+                 attachment_size=1024, events=0, project='SRC', seed=1):
+        self.project = project
+        self.attachment_size = attachment_size
+        self._random = random.Random(seed)
+        self._ids = iter(range(10000, 10 ** 9))
+        self.issues = collections.OrderedDict()
+        for e in range(epics):
+            epic = self._add_issue('Epic', 'Open', fields={
+                EPIC_NAME_FIELD_ID: 'Epic %d' % e,
+            })
+            for s in range(stories_per_epic):
+                story = self._add_issue('Story', self._random.choice(('Open', 'In Progress', 'Closed')),
+                        comments_per_issue, worklogs_per_issue, attachments_per_issue, fields={
+                    EPIC_LINK_FIELD_ID: epic['key'],
+                    SPRINT_FIELD_ID: ['com.atlassian.greenhopper.service.sprint.Sprint@1[id=%d,'
+                                      'name=Sprint %d,state=CLOSED]' % (s % 4, s % 4)],
+                })
+                for t in range(subtasks_per_story):
+                    subtask = self._add_issue('Sub-task', self._random.choice(('To Do', 'Done')),
+                            comments_per_issue, worklogs_per_issue, attachments_per_issue, fields={
+                        'parent': {'key': story['key']},
+                    })
+                    story['fields']['subtasks'].append({'key': subtask['key']})
+        self.events = self._make_events(events)
+
+    def __len__(self):
+        return len(self.issues)
+
+    def _add_issue(self, issue_type, status, comments=0, worklogs=0, attachments=0, fields=None):
+        number = len(self.issues) + 1
+        key = '%s-%d' % (self.project, number)
+        issue_fields = {
+            'project': {'key': self.project},
+            'summary': '%s %d' % (issue_type, number),
+            'description': 'Description of %s\n* with a list item' % key,
+            'issuetype': {'name': issue_type},
+            'status': {'name': status},
+            'resolution': {'name': 'Fixed'} if status in ('Closed', 'Done') else None,
+            'priority': {'name': self._random.choice(('Major', 'Minor', 'Critical'))},
+            'assignee': {'name': 'user%d' % (number % 5), 'displayName': 'User %d' % (number % 5)},
+            'reporter': {'name': 'usera', 'displayName': 'User A'},
+            'labels': [],
+            'environment': None,
+            'components': [{'name': 'Component %d' % (number % 3)}],
+            'fixVersions': [{'name': '1.%d' % (number % 3)}],
+            'issuelinks': [],
+            'subtasks': [],
+            'aggregatetimeoriginalestimate': 3600 * (number % 8),
+            'aggregatetimespent': 1800 * worklogs,
+            'aggregatetimeestimate': 900 * (number % 4),
+            'comment': {'comments': [self._make_comment(key, i) for i in range(comments)],
+                        'total': comments, 'maxResults': comments, 'startAt': 0},
+            'worklog': {'total': worklogs, 'maxResults': ISSUE_WORKLOG_PAGE_SIZE, 'worklogs': []},
+            'attachment': [self._make_attachment(i) for i in range(attachments)],
+            EPIC_LINK_FIELD_ID: None,
+        }
+        issue_fields.update(fields or {})
+        issue = {'id': str(next(self._ids)), 'key': key, 'fields': issue_fields,
+                 'worklogs': [self._make_worklog(i) for i in range(worklogs)]}
+        issue_fields['worklog']['worklogs'] = issue['worklogs'][:ISSUE_WORKLOG_PAGE_SIZE]
+        self.issues[key] = issue
+        return issue
+
+    def _make_comment(self, key, i):
+        return {'id': str(next(self._ids)), 'body': 'Comment %d on %s' % (i, key),
+                'author': {'name': 'usera', 'displayName': 'User A'}}
+
+    def _make_worklog(self, i):
+        return {'id': str(next(self._ids)), 'timeSpentSeconds': 1800,
+                'started': '2024-01-%02dT09:00:00.000+0000' % (i % 28 + 1),
+                'author': {'name': 'usera', 'displayName': 'User A'}}
+
+    def _make_attachment(self, i):
+        return {'id': str(next(self._ids)), 'filename': 'file %d.bin' % i,
+                'size': self.attachment_size}
+
+    def _make_events(self, count):
+        stories = [key for key, issue in self.issues.items()
+                   if issue['fields']['issuetype']['name'] == 'Story']
+        start = datetime.datetime(2024, 1, 1, 8)
+        events = []
+        for i in range(count if stories else 0):
+            begin = start + datetime.timedelta(days=i // 8, hours=i % 8)
+            events.append({
+                'id': 'event%d' % i,
+                'summary': '%s: work item %d' % (stories[i % len(stories)], i),
+                'start': {'dateTime': begin.isoformat() + '+00:00'},
+                'end': {'dateTime': (begin + datetime.timedelta(minutes=45)).isoformat() + '+00:00'},
+            })
+        return events
+
+
+class StubServer(object):
+    """
+    Serves the dataset on a local port in a background thread. An empty
+    dataset makes a destination JIRA for export/import. Every request waits
+    latency seconds and is counted per endpoint, named after its handler.
+    """
+
+    def __init__(self, dataset=None, latency=0.0):
+        self.dataset = dataset or Dataset(epics=0, project='DEST')
+        self.latency = latency
+        self.request_counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._issues = self.dataset.issues
+        self._next_number = len(self._issues) + 1
+        self._next_id = 10 ** 9
+        self._versions = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_counts.clear()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.request_counts[endpoint] += 1
+
+    def new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return str(self._next_id)
+
+    # JIRA
+
+    def server_info(self, handler, match, query, body):
+        return 200, {'baseUrl': self.url, 'version': '9.4.0', 'versionNumbers': [9, 4, 0],
+                     'deploymentType': 'Server', 'serverTitle': 'Stub JIRA'}
+
+    def fields(self, handler, match, query, body):
+        return 200, FIELDS
+
+    def search(self, handler, match, query, body):
+        if body:
+            params = json.loads(body)
+        else:
+            params = dict((name, values[0]) for name, values in query.items())
+            if 'fields' in query:
+                params['fields'] = ','.join(query['fields'])
+        try:
+            predicate = _parse_jql(params.get('jql', ''))
+        except ValueError as e:
+            return 400, {'errorMessages': [str(e)], 'errors': {}}
+        start_at = int(params.get('startAt', 0))
+        max_results = min(int(params.get('maxResults', 50)), MAX_SEARCH_RESULTS)
+        fields = params.get('fields')
+        if isinstance(fields, list):
+            fields = ','.join(fields)
+        with self._lock:
+            matches = [issue for issue in self._issues.values() if predicate(issue)]
+        return 200, {
+            'startAt': start_at,
+            'maxResults': max_results,
+            'total': len(matches),
+            'issues': [self._to_json(issue, fields) for issue in
+                       matches[start_at:start_at + max_results]],
+        }
+
+    def get_issue(self, handler, match, query, body):
+        issue = self._issues.get(match.group('key'))
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        return 200, self._to_json(issue)
+
+    def create_issue(self, handler, match, query, body):
+        return 201, self._create(json.loads(body)['fields'])
+
+    def create_issues(self, handler, match, query, body):
+        created = [self._create(update['fields']) for update in json.loads(body)['issueUpdates']]
+        return 201, {'issues': created, 'errors': []}
+
+    def _create(self, fields):
+        with self._lock:
+            key = '%s-%d' % (self.dataset.project, self._next_number)
+            self._next_number += 1
+        stored = dict(fields)
+        stored.update({
+            'status': {'name': 'Open'},
+            'subtasks': [],
+            'issuelinks': [],
+            'comment': {'comments': [], 'total': 0, 'maxResults': 0, 'startAt': 0},
+            'worklog': {'total': 0, 'maxResults': ISSUE_WORKLOG_PAGE_SIZE, 'worklogs': []},
+            'attachment': [],
+        })
+        issue = {'id': self.new_id(), 'key': key, 'fields': stored, 'worklogs': []}
+        with self._lock:
+            self._issues[key] = issue
+        return {'id': issue['id'], 'key': key, 'self': '%s/rest/api/2/issue/%s' % (self.url, key)}
+
+    def transitions(self, handler, match, query, body):
+        return 200, {'transitions': [{'id': str(i + 11), 'name': name, 'to': {'name': name}}
+                                     for i, name in enumerate(TRANSITIONS)]}
+
+    def transition(self, handler, match, query, body):
+        return 204, None
+
+    def add_comment(self, handler, match, query, body):
+        comment = json.loads(body)
+        comment.update({'id': self.new_id(), 'author': {'name': USER, 'displayName': USER}})
+        return 201, comment
+
+    def worklogs(self, handler, match, query, body):
+        issue = self._issues.get(match.group('key'))
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        with self._lock:
+            worklogs = list(issue['worklogs'])
+        return 200, {'startAt': 0, 'maxResults': len(worklogs), 'total': len(worklogs),
+                     'worklogs': worklogs}
+
+    def add_worklog(self, handler, match, query, body):
+        issue = self._issues.get(match.group('key'))
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        worklog = json.loads(body)
+        worklog.update({'id': self.new_id(), 'author': {'name': USER, 'displayName': USER}})
+        worklog.setdefault('started', datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000+0000'))
+        with self._lock:
+            issue['worklogs'].append(worklog)
+        return 201, worklog
+
+    def add_attachment(self, handler, match, query, body):
+        filename = re.search(br'filename="([^"]*)"', body or b'')
+        return 200, [{'id': self.new_id(), 'size': len(body or b''),
+                      'filename': filename.group(1).decode('utf-8') if filename else 'file'}]
+
+    def attachment_content(self, handler, match, query, body):
+        return 200, _AttachmentContent(self.dataset.attachment_size)
+
+    def project(self, handler, match, query, body):
+        key = match.group('key')
+        return 200, {'id': '10000', 'key': key, 'name': key,
+                     'self': '%s/rest/api/2/project/%s' % (self.url, key)}
+
+    def project_versions(self, handler, match, query, body):
+        with self._lock:
+            return 200, list(self._versions)
+
+    def create_version(self, handler, match, query, body):
+        version = json.loads(body)
+        version['id'] = self.new_id()
+        with self._lock:
+            self._versions.append(version)
+        return 201, version
+
+    def issue_link_types(self, handler, match, query, body):
+        return 200, {'issueLinkTypes': [{'id': '1', 'name': 'sub-epic', 'inward': 'is sub-epic of',
+                                         'outward': 'has sub-epic'}]}
+
+    def create_issue_link(self, handler, match, query, body):
+        return 201, None
+
+    def add_issues_to_epic(self, handler, match, query, body):
+        return 204, None
+
+    # Google Calendar
+
+    def calendar_list(self, handler, match, query, body):
+        return 200, {'items': [{'id': CALENDAR_ID, 'summary': CALENDAR_NAME}]}
+
+    def events(self, handler, match, query, body):
+        events = self.dataset.events
+        # The sync token is the event count, only appended events are changes.
+        if 'syncToken' in query:
+            events = events[int(query['syncToken'][0]):]
+        start = int(query.get('pageToken', ['0'])[0])
+        page_size = min(int(query.get('maxResults', [CALENDAR_PAGE_SIZE])[0]), 2500)
+        result = {'items': events[start:start + page_size]}
+        if start + page_size < len(events):
+            result['nextPageToken'] = str(start + page_size)
+        else:
+            result['nextSyncToken'] = str(len(self.dataset.events))
+        return 200, result
+
+    def _to_json(self, issue, fields=None):
+        issue_fields = issue['fields']
+        if fields and fields not in ('*all', '*navigable'):
+            names = fields.split(',')
+            issue_fields = dict((name, value) for name, value in issue_fields.items()
+                                if name in names)
+        result = {'id': issue['id'], 'key': issue['key'],
+                  'self': '%s/rest/api/2/issue/%s' % (self.url, issue['key']),
+                  'fields': dict(issue_fields)}
+        if 'attachment' in result['fields']:
+            result['fields']['attachment'] = [dict(attachment,
+                    self='%s/rest/api/2/attachment/%s' % (self.url, attachment['id']),
+                    content='%s/secure/attachment/%s/%s' % (self.url, attachment['id'],
+                                                            attachment['filename']))
+                    for attachment in result['fields']['attachment']]
+        return result
+
+
+ROUTES = [
+    ('GET', r'/rest/api/2/serverInfo$', StubServer.server_info),
+    ('GET', r'/rest/api/2/field$', StubServer.fields),
+    ('GET', r'/rest/api/2/search$', StubServer.search),
+    ('POST', r'/rest/api/2/search$', StubServer.search),
+    ('POST', r'/rest/api/2/issue$', StubServer.create_issue),
+    ('POST', r'/rest/api/2/issue/bulk$', StubServer.create_issues),
+    ('GET', r'/rest/api/2/issue/(?P<key>[^/]+)$', StubServer.get_issue),
+    ('GET', r'/rest/api/2/issue/(?P<key>[^/]+)/transitions$', StubServer.transitions),
+    ('POST', r'/rest/api/2/issue/(?P<key>[^/]+)/transitions$', StubServer.transition),
+    ('POST', r'/rest/api/2/issue/(?P<key>[^/]+)/comment$', StubServer.add_comment),
+    ('GET', r'/rest/api/2/issue/(?P<key>[^/]+)/worklog$', StubServer.worklogs),
+    ('POST', r'/rest/api/2/issue/(?P<key>[^/]+)/worklog$', StubServer.add_worklog),
+    ('POST', r'/rest/api/2/issue/(?P<key>[^/]+)/attachments$', StubServer.add_attachment),
+    ('GET', r'/secure/attachment/\d+/.*$', StubServer.attachment_content),
+    ('GET', r'/rest/api/2/project/(?P<key>[^/]+)$', StubServer.project),
+    ('GET', r'/rest/api/2/project/[^/]+/versions$', StubServer.project_versions),
+    ('POST', r'/rest/api/2/version$', StubServer.create_version),
+    ('GET', r'/rest/api/2/issueLinkType$', StubServer.issue_link_types),
+    ('POST', r'/rest/api/2/issueLink$', StubServer.create_issue_link),
+    ('POST', r'/rest/agile/1.0/epic/[^/]+/issue$', StubServer.add_issues_to_epic),
+    ('GET', r'/calendar/v3/users/me/calendarList$', StubServer.calendar_list),
+    ('GET', r'/calendar/v3/calendars/[^/]+/events$', StubServer.events),
+]
+ROUTES = [(method, re.compile(pattern), handler) for method, pattern, handler in ROUTES]
+
+
+class _AttachmentContent(object):
+    """Attachment content that is generated while it is sent."""
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, size):
+        self.size = size
+
+    def write_to(self, wfile):
+        chunk = b'x' * self.CHUNK_SIZE
+        remaining = self.size
+        while remaining > 0:
+            wfile.write(chunk[:remaining])
+            remaining -= self.CHUNK_SIZE
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body together, separate small writes stall on delayed ACKs.
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def _dispatch(self, method):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        if stub.latency:
+            time.sleep(stub.latency)
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                stub.count(handler.__name__)
+                status, result = handler(stub, self, match, parse_qs(url.query), body)
+                break
+        else:
+            stub.count('unknown')
+            status, result = 404, {'errorMessages': ['No stub for %s %s' % (method, path)]}
+        self._respond(status, result)
+
+    def _respond(self, status, result):
+        self.send_response(status)
+        if isinstance(result, _AttachmentContent):
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(result.size))
+            self.end_headers()
+            result.write_to(self.wfile)
+            return
+        data = b'' if result is None else json.dumps(result).encode('utf-8')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+_IN_REGEX = re.compile(r'^(key|parent|"Epic Link")\s+in\s+\((.*)\)$', re.I)
+_EQUALS_REGEX = re.compile(r'^(project|type|issuetype|status)\s*=\s*"?([^"]*)"?$', re.I)
+_NOT_EMPTY_REGEX = re.compile(r"""^['"](.+)['"]\s+is\s+not\s+EMPTY$""", re.I)
+
+
+def _parse_jql(jql):
+    """Supports the clauses used by ask-jira joined with 'and'."""
+    jql = re.split(r'\s+order\s+by\s+', jql, flags=re.I)[0].strip()
+    predicates = [_parse_clause(clause.strip()) for clause in re.split(r'\s+and\s+', jql, flags=re.I)
+                  if clause.strip()]
+    return lambda issue: all(predicate(issue['key'], issue['fields']) for predicate in predicates)
+
+
+def _parse_clause(clause):
+    match = _IN_REGEX.match(clause)
+    if match:
+        name, values = match.group(1).lower(), set(v.strip() for v in match.group(2).split(','))
+        if name == 'key':
+            return lambda key, fields: key in values
+        if name == 'parent':
+            return lambda key, fields: (fields.get('parent') or {}).get('key') in values
+        return lambda key, fields: fields.get(EPIC_LINK_FIELD_ID) in values
+    match = _EQUALS_REGEX.match(clause)
+    if match:
+        name, value = match.group(1).lower(), match.group(2)
+        if name == 'project':
+            # Created issues store the project key as given in the request.
+            return lambda key, fields: (fields['project'] == value or
+                                        fields['project'].get('key') == value)
+        if name == 'status':
+            return lambda key, fields: fields['status']['name'] == value
+        return lambda key, fields: fields['issuetype']['name'] == value
+    match = _NOT_EMPTY_REGEX.match(clause)
+    if match:
+        field_id = next((field['id'] for field in FIELDS if field['name'] == match.group(1)), None)
+        return lambda key, fields: bool(fields.get(field_id))
+    raise ValueError("Unsupported JQL clause '%s'" % clause)
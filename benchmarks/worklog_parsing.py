@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Measures how fast Google Calendar events and JIRA worklogs are parsed into
+worklogs by lib.google_calendar, with the fast ISO-8601 path and with
+dateutil only for comparison.
+
+    $ python benchmarks/worklog_parsing.py [--count 100000] [--jira-timezone Europe/Tallinn]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dateutil.parser
+
+from lib import google_calendar
+from lib.google_calendar import Worklog
+
+
+def _make_events(count):
+    start = datetime.datetime(2024, 1, 1, 9, 0)
+    events = []
+    for i in range(count):
+        event_start = start + datetime.timedelta(minutes=30 * i)
+        event_end = event_start + datetime.timedelta(minutes=90)
+        events.append({
+            'summary': 'PROJ-%d: work' % (i % 500 + 1),
+            'start': {'dateTime': event_start.isoformat() + '+02:00'},
+            'end': {'dateTime': event_end.isoformat() + '+02:00'},
+        })
+    return events
+
+
+def _make_jira_worklogs(count):
+    start = datetime.datetime(2024, 1, 1, 7, 0)
+    return [SimpleNamespace(started=(start + datetime.timedelta(minutes=30 * i)).strftime(
+                '%Y-%m-%dT%H:%M:%S.000+0000'), timeSpentSeconds=5400)
+            for i in range(count)]
+
+
+def _time(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return time.perf_counter() - start
+
+
+def _run(events, jira_worklogs, jira_timezone):
+    return (_time(lambda event: Worklog.from_gcal(event, jira_timezone), events),
+            _time(Worklog.from_jira, jira_worklogs))
+
+
+def _main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=100000,
+                        help='number of events and worklogs (default: 100000)')
+    parser.add_argument('--jira-timezone', help='JIRA_TIMEZONE setting (default: none)')
+    args = parser.parse_args()
+
+    events = _make_events(args.count)
+    jira_worklogs = _make_jira_worklogs(args.count)
+    print('%-10s %12s %12s' % ('parser', 'events s', 'worklogs s'))
+    print('%-10s %12.3f %12.3f' % (('fast',) + _run(events, jira_worklogs, args.jira_timezone)))
+    parse_iso_date = google_calendar._parse_iso_date
+    google_calendar._parse_iso_date = dateutil.parser.parse
+    try:
+        print('%-10s %12.3f %12.3f' % (('dateutil',) +
+                                        _run(events, jira_worklogs, args.jira_timezone)))
+    finally:
+        google_calendar._parse_iso_date = parse_iso_date
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
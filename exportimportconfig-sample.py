@@ -5,6 +5,8 @@ JIRA = {
     'user': 'user2',
     'password': 'password2',
     'project': 'PROJECTKEY',
+    # Limit the request rate and retry throttled requests, remove for no limit.
+    'requests-per-second': 10,
 }
 
 PRIORITY_MAP = {
@@ -99,6 +101,11 @@ STATUS_TRANSITIONS_ISSUETYPE = {
 INCLUDE_WORKLOGS = True
 ADD_COMMENT_TO_OLD_ISSUE = True
 
+# Attachments larger than this are spooled to a temporary file during transfer.
+ATTACHMENT_SPOOL_SIZE = 10 * 1024 * 1024
+# Limit for the total size of attachments transferred at the same time, None for no limit.
+ATTACHMENT_MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+
 PORTFOLIO_EPIC_LABEL = 'porfolio-epic'
 PORTFOLIO_EPIC_SUB_EPIC_SOURCE_LINK_NAME = 'sub-epic'
 PORTFOLIO_EPIC_SUB_EPIC_TARGET_LINK_NAME = 'sub-epic'
@@ -3,5 +3,15 @@ import keyring
 JIRA = {
     "server": "https://example.com/jira/",
     "user": "user",
-    "password": keyring.get_password("system", "user")
+    "password": keyring.get_password("system", "user"),
+    # Uncomment to limit the request rate and retry throttled requests.
+    # "requests-per-second": 10,
 }
+
+# Uncomment to cache responses of read-only commands locally.
+# CACHE = {
+#     "directory": "~/.cache/ask-jira",
+#     "max-size": 50 * 1024 * 1024,
+#     # time to live in seconds per endpoint URL pattern
+#     "ttl": {r"/rest/api/2/project$": 24 * 60 * 60},
+# }
@@ -0,0 +1,130 @@
+from __future__ import print_function
+
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+# Commands are sent as a single JSON line {"argv": [...], "cwd": "..."},
+# the daemon answers with JSON lines {"stdout": "..."} and {"stderr": "..."}
+# while the command runs and finishes with {"exit": <status>}.
+
+
+def serve(socket_path, run_command):
+    """
+    Accepts commands on the Unix domain socket and runs them one at a time
+    with run_command(argv), streaming their output back to the client.
+    """
+    socket_path = os.path.expanduser(socket_path)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    print('Listening on', socket_path)
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                _handle(connection, run_command)
+    except (KeyboardInterrupt, _Stopped):
+        pass
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def forward(socket_path, argv):
+    """
+    Runs the command in the daemon listening on the socket and writes its
+    output to stdout and stderr. Returns the exit status of the command or
+    None if no daemon is listening.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(os.path.expanduser(socket_path))
+    except (IOError, OSError):
+        client.close()
+        return None
+    with client:
+        client.sendall(_encode({'argv': argv, 'cwd': os.getcwd()}))
+        for message in _read_messages(client):
+            if 'exit' in message:
+                return message['exit']
+            for name, stream in (('stdout', sys.stdout), ('stderr', sys.stderr)):
+                if name in message:
+                    stream.write(message[name])
+                    stream.flush()
+    print('Daemon closed the connection before the command finished', file=sys.stderr)
+    return 1
+
+
+class _Stopped(BaseException):
+    pass
+
+
+def _stop(signum, frame):
+    raise _Stopped()
+
+
+class _StreamWriter(object):
+    """File-like object that sends everything written to it to the client."""
+
+    def __init__(self, connection, name):
+        self._connection = connection
+        self._name = name
+
+    def write(self, text):
+        if text:
+            self._connection.sendall(_encode({self._name: text}))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _handle(connection, run_command):
+    try:
+        request = next(_read_messages(connection))
+    except (StopIteration, ValueError):
+        return
+    status = 0
+    cwd = os.getcwd()
+    try:
+        with redirect_stdout(_StreamWriter(connection, 'stdout')), \
+                redirect_stderr(_StreamWriter(connection, 'stderr')):
+            try:
+                os.chdir(request.get('cwd', cwd))
+                run_command(request['argv'])
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                if not isinstance(e.code, (int, type(None))):
+                    print(e.code, file=sys.stderr)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        connection.sendall(_encode({'exit': status}))
+    except (IOError, OSError):
+        print('Client disconnected while running', ' '.join(request['argv']),
+              file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+
+
+def _encode(message):
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def _read_messages(connection):
+    with connection.makefile('r', encoding='utf-8') as lines:
+        for line in lines:
+            yield json.loads(line)
@@ -1,94 +1,368 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import itertools
+import sys
+import tempfile
+import threading
 import unicodedata
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO, StringIO
 from jira.client import JIRA
 from jira.exceptions import JIRAError
 
+from . import profiling
+from . import search
+from . import throttling
+from .migration_journal import MigrationJournal
 
-def export_import_issues(source_jira, conf, query, portfolio_epics=False):
+
+def export_import_issues(source_jira, conf, query, portfolio_epics=False, workers=1,
+        journal_file=None, bulk_create=False):
     dest_jira = JIRA({'server': conf.JIRA['server']},
                 basic_auth=(conf.JIRA['user'], conf.JIRA['password']))
-    source_issues = source_jira.search_issues(query, maxResults=False)
-    if not source_issues:
+    throttling.configure(dest_jira, conf.JIRA, workers)
+    profiling.install(dest_jira._session)
+    if workers > 1:
+        throttling.set_pool_size(source_jira._session, workers)
+    # Source issues are fetched and migrated one page at a time.
+    _g_subtasks.clear()
+    pages = _fetch_source_issue_pages(source_jira, query)
+    first_page = next(pages, None)
+    if not first_page:
         print('No issues found for query', query, 'exiting')
         return []
-    if portfolio_epics and not _has_portfolio_epic_label(source_issues[0], conf):
+    if portfolio_epics and not _has_portfolio_epic_label(first_page[0], conf):
         print('Portfolio epics requested, but first issue',
-                source_issues[0].key, 'does not have portfolio epic label',
+                first_page[0].key, 'does not have portfolio epic label',
                 conf.PORTFOLIO_EPIC_LABEL)
         return []
     result = []
-    print('About to export/import', len(source_issues), 'issues')
-    _make_dest_issues(source_jira, dest_jira, source_issues, conf, result, None, portfolio_epics)
+    _open_journal(journal_file)
+    try:
+        with profiling.phase('fetch'):
+            _load_imported_issues(conf, dest_jira)
+            _load_project_versions(conf, dest_jira)
+        _init_attachment_budget(conf)
+        _g_epic_map.clear()
+        _g_transition_ids.clear()
+        print('About to export/import', first_page.total, 'issues')
+        for page in itertools.chain([first_page], pages):
+            if first_page.total > len(first_page):
+                print('Page of issues', page.startAt + 1, '-',
+                        page.startAt + len(page), 'of', page.total)
+            source_issues = _without_subtasks_of_page(page)
+            if bulk_create:
+                with profiling.phase('create'):
+                    source_issues = _bulk_create_dest_issues(dest_jira, source_issues, conf)
+            if workers > 1:
+                _make_dest_issues_concurrently(source_jira, dest_jira, source_issues, conf, result,
+                        portfolio_epics, workers)
+            else:
+                _make_dest_issues(source_jira, dest_jira, source_issues, conf, result, None, portfolio_epics)
+    finally:
+        _g_journal.close()
     return result
 
 
+def plan_export_import(source_jira, conf, query, portfolio_epics=False, bulk_create=False):
+    """
+    Counts the issues, subtasks, epics, portfolio sub-epics, comments,
+    worklogs and attachments that export_import_issues() would migrate for
+    the given query and estimates the number of destination and source API
+    calls per phase as reported by --profile. Only reads from the source
+    JIRA. Issues that have already been imported are not taken into
+    account, so the estimates are upper bounds.
+    """
+    plan = _MigrationPlan()
+    fields = PLAN_ISSUE_FIELDS + ',' + conf.SOURCE_EPIC_LINK_FIELD_ID
+    # The source field names are loaded with the first search.
+    plan.source_calls['fetch'] += 1
+    for page in _plan_search_pages(source_jira, query, fields, plan):
+        page = _without_subtasks_of_page(page)
+        plan.counts['issues'] += len(page)
+        plan.bulk_batches += -(-len(page) // BULK_CREATE_BATCH_SIZE)
+        _plan_issues(source_jira, page, conf, fields, plan, portfolio_epics)
+    return plan.summary(conf, bulk_create)
+
+
+def _plan_search_pages(source_jira, query, fields, plan):
+    # A search sends one request per page, or one if nothing matches.
+    plan.source_calls['fetch'] += 1
+    for index, page in enumerate(search.search_issue_pages(source_jira, query, fields=fields)):
+        if index:
+            plan.source_calls['fetch'] += 1
+        yield page
+
+
+PLAN_ISSUE_FIELDS = 'parent,subtasks,issuelinks,labels,status,issuetype,comment,worklog,attachment,fixVersions'
+
+# Calls that create an issue: project lookup, creation and fetching the created issue.
+CREATE_ISSUE_CALLS = 3
+
+class _MigrationPlan(object):
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.calls = collections.Counter()
+        self.source_calls = collections.Counter()
+        self.bulk_batches = 0
+        self.epics = set()
+        self.versions = set()
+        self.transition_steps = set()
+        self.seen = set()
+
+    def summary(self, conf, bulk_create):
+        calls = self.calls.copy()
+        # Top-level issues are created in batches of each page in bulk mode.
+        if bulk_create:
+            calls['create'] -= CREATE_ISSUE_CALLS * self.counts['issues']
+            calls['create'] += self.bulk_batches
+        # Epics that match the query are migrated like other issues.
+        epics = self.epics - self.seen
+        calls['create'] += CREATE_ISSUE_CALLS * len(epics)
+        calls['create'] += len(self.versions)
+        # The destination field names, at least one page of already imported
+        # issues and the project versions.
+        calls['fetch'] += 3
+        calls['transition'] += len(self.transition_steps)
+        calls['total'] = sum(calls.values())
+        source_calls = self.source_calls.copy()
+        source_calls['fetch'] += len(epics)
+        if conf.ADD_COMMENT_TO_OLD_ISSUE:
+            source_calls['comment'] += (self.counts['issues'] + self.counts['subtasks'] +
+                    self.counts['portfolio sub-epics'])
+        source_calls['total'] = sum(source_calls.values())
+        return {
+            'issues': self.counts['issues'],
+            'subtasks': self.counts['subtasks'],
+            'epics': len(epics),
+            'portfolio sub-epics': self.counts['portfolio sub-epics'],
+            'comments': self.counts['comments'],
+            'worklogs': self.counts['worklogs'],
+            'attachments': self.counts['attachments'],
+            'attachment bytes': self.counts['attachment bytes'],
+            'destination API calls': dict(calls),
+            'source API calls': dict(source_calls),
+        }
+
+
+def _plan_issues(source_jira, source_issues, conf, fields, plan, portfolio_epics):
+    source_issues = [source_issue for source_issue in source_issues
+            if source_issue.key not in plan.seen]
+    plan.seen.update(source_issue.key for source_issue in source_issues)
+    parents = [source_issue for source_issue in source_issues if source_issue.fields.subtasks]
+    subtasks = []
+    if parents:
+        query = 'parent in ({})'.format(','.join(parent.key for parent in parents))
+        subtasks = list(itertools.chain.from_iterable(
+                _plan_search_pages(source_jira, query, fields, plan)))
+        plan.counts['subtasks'] += len(subtasks)
+    for source_issue in source_issues + subtasks:
+        _plan_issue(source_issue, conf, plan)
+
+    if not portfolio_epics:
+        return
+    sub_epic_keys = [linked_issue.outwardIssue.key for source_issue in source_issues
+            if _has_portfolio_epic_label(source_issue, conf)
+            for linked_issue in source_issue.fields.issuelinks
+            if linked_issue.type.name == conf.PORTFOLIO_EPIC_SUB_EPIC_SOURCE_LINK_NAME
+            and hasattr(linked_issue, 'outwardIssue')]
+    plan.calls['link'] += len(sub_epic_keys)
+    sub_epic_keys = [key for key in sub_epic_keys if key not in plan.seen]
+    if sub_epic_keys:
+        query = 'key in ({})'.format(','.join(sub_epic_keys))
+        sub_epics = list(itertools.chain.from_iterable(
+                _plan_search_pages(source_jira, query, fields, plan)))
+        plan.counts['portfolio sub-epics'] += len(sub_epics)
+        _plan_issues(source_jira, sub_epics, conf, fields, plan, portfolio_epics)
+
+
+def _plan_issue(source_issue, conf, plan):
+    fields = source_issue.fields
+    plan.calls['create'] += CREATE_ISSUE_CALLS
+    if getattr(fields, conf.SOURCE_EPIC_LINK_FIELD_ID, None):
+        plan.epics.add(getattr(fields, conf.SOURCE_EPIC_LINK_FIELD_ID))
+        plan.calls['link'] += 1
+    issue_type, transitions = _get_transitions(source_issue, conf)
+    plan.calls['transition'] += len(transitions)
+    for step in range(len(transitions)):
+        plan.transition_steps.add((issue_type, transitions[:step + 1]))
+    for version in getattr(fields, 'fixVersions', None) or []:
+        plan.versions.add(version.name)
+    if fields.comment:
+        plan.counts['comments'] += fields.comment.total
+        plan.calls['comment'] += fields.comment.total
+    plan.calls['comment'] += 1
+    if fields.worklog:
+        plan.counts['worklogs'] += fields.worklog.total
+        if conf.INCLUDE_WORKLOGS:
+            plan.calls['worklog'] += fields.worklog.total
+            # Issues include only the first page of worklogs.
+            if fields.worklog.total > len(fields.worklog.worklogs):
+                plan.source_calls['fetch'] += 1
+    for attachment in fields.attachment or []:
+        plan.counts['attachments'] += 1
+        plan.counts['attachment bytes'] += attachment.size
+        plan.calls['attach'] += 1
+        plan.source_calls['attach'] += 1
+
+
+# Source issues are fetched with all fields, including comments,
+# attachments and worklogs, so that they need not be re-fetched.
+SOURCE_ISSUE_FIELDS = '*all'
+
+def _fetch_source_issue_pages(source_jira, query):
+    pages = search.search_issue_pages(source_jira, query, fields=SOURCE_ISSUE_FIELDS)
+    while True:
+        # The phase must not cover the caller's work while the page is yielded.
+        with profiling.phase('fetch'):
+            page = next(pages, None)
+            if page is None:
+                return
+            _load_subtasks(source_jira, page)
+        yield page
+
+
+def _fetch_source_issues(source_jira, query):
+    return list(itertools.chain.from_iterable(_fetch_source_issue_pages(source_jira, query)))
+
+
+# Maps source parent issue keys to their subtasks that are waiting to be imported.
+_g_subtasks = {}
+
+def _load_subtasks(source_jira, source_issues):
+    parents = [source_issue for source_issue in source_issues if source_issue.fields.subtasks]
+    if not parents:
+        return
+    query = 'parent in ({})'.format(','.join(parent.key for parent in parents))
+    subtasks = dict((subtask.key, subtask) for subtask in
+            search.iter_issues(source_jira, query, fields=SOURCE_ISSUE_FIELDS))
+    for parent in parents:
+        _g_subtasks[parent.key] = [subtasks.get(subtask.key) or source_jira.issue(subtask.key)
+                for subtask in parent.fields.subtasks]
+
+
+def _make_dest_issues_concurrently(source_jira, dest_jira, source_issues, conf, result,
+        portfolio_epics, workers):
+    # Top-level issues are independent, each worker migrates one of them
+    # together with its subtasks and sub-epics. Output and result keys are
+    # collected per issue and emitted in source order.
+    def make_dest_issue(source_issue):
+        issue_result = []
+        error = None
+        _g_output.buffer = StringIO()
+        try:
+            _make_dest_issues(source_jira, dest_jira, [source_issue], conf,
+                    issue_result, None, portfolio_epics)
+        except Exception as e:
+            error = e
+        finally:
+            output = _g_output.buffer.getvalue()
+            _g_output.buffer = None
+        return issue_result, output, error
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for issue_result, output, error in executor.map(make_dest_issue, source_issues):
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            result.extend(issue_result)
+            if error:
+                raise error
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
 def _make_dest_issues(source_jira, dest_jira, source_issues, conf, result, parent, portfolio_epics):
     for source_issue in source_issues:
-        if _already_imported(conf, dest_jira, source_issue.key):
-            print('Issue', source_issue.key, 'has already been imported, skipping...')
-            continue
-        if not parent:
-            print('Exporting', source_issue.key, end=' ')
-
-        dest_issue = _map_issue(source_jira, dest_jira, source_issue, conf, result, parent, portfolio_epics)
+        # The whole migration of an issue holds its lock, a worker that meets
+        # an issue that another worker has migrated meanwhile skips it.
+        with _issue_lock(source_issue.key):
+            if _is_imported(conf, source_issue.key):
+                _print('Issue', source_issue.key, 'has already been imported, skipping...')
+                _g_subtasks.pop(source_issue.key, None)
+                continue
+            if not parent:
+                _print('Exporting', source_issue.key, end=' ')
+
+            dest_issue = _map_issue(source_jira, dest_jira, source_issue, conf, result, parent, portfolio_epics)
+            _g_journal.record(source_issue.key, 'done')
 
         result.append(dest_issue.key)
         if not parent:
-            print('done')
+            _print('done')
 
 
-def _map_issue(source_jira, dest_jira, source_issue, conf, result, parent, portfolio_epics):
-    # Re-fetch to include comments and attachments.
-    source_issue = source_jira.issue(source_issue.key, expand='comments,attachments')
-    fields = _get_dest_issue_fields(source_issue.fields, conf)
-    if parent:
-        fields['parent'] = {'key': parent.key}
-    _add_source_jira_issue_key(conf, fields, source_issue.key)
-    _map_versions(dest_jira, source_issue, fields, conf)
+def _without_subtasks_of_page(source_issues):
+    """
+    Leaves out subtasks whose parent is in the same page, the parent's
+    migration creates them under the parent.
+    """
+    keys = set(source_issue.key for source_issue in source_issues)
+    return [source_issue for source_issue in source_issues
+            if getattr(getattr(source_issue.fields, 'parent', None), 'key', None) not in keys]
 
-    dest_issue = dest_jira.create_issue(fields=fields)
+
+def _map_issue(source_jira, dest_jira, source_issue, conf, result, parent, portfolio_epics):
+    with profiling.phase('create'):
+        dest_issue = _create_dest_issue(source_issue, conf, dest_jira, parent)
     if not parent:
-        print('to', dest_issue.key, '...', end=' ')
+        _print('to', dest_issue.key, '...', end=' ')
 
-    _set_epic_link(dest_issue, source_issue, conf, source_jira, dest_jira)
-    _set_status(dest_issue, source_issue, conf, dest_jira)
+    if not _g_journal.has(source_issue.key, 'epic-linked'):
+        _set_epic_link(dest_issue, source_issue, conf, source_jira, dest_jira)
+        _g_journal.record(source_issue.key, 'epic-linked')
+    with profiling.phase('transition'):
+        _set_status(dest_issue, source_issue, conf, dest_jira)
 
     # Worklogs.
     if conf.INCLUDE_WORKLOGS and source_issue.fields.worklog:
-        for worklog in source_issue.fields.worklog.worklogs:
-            dest_jira.add_worklog(dest_issue, None, worklog.timeSpentSeconds)
+        with profiling.phase('fetch'):
+            worklogs = _get_source_worklogs(source_jira, source_issue)
+        with profiling.phase('worklog'):
+            for worklog in worklogs:
+                step = 'worklog:' + worklog.id
+                if not _g_journal.has(source_issue.key, step):
+                    dest_jira.add_worklog(dest_issue, None, worklog.timeSpentSeconds)
+                    _g_journal.record(source_issue.key, step)
 
     # Attachments.
-    if source_issue.fields.attachment:
+    if source_issue.fields.attachment and not _g_journal.has(source_issue.key, 'attachments'):
         try:
-            _add_attachments(dest_issue, dest_jira, source_issue.fields.attachment)
+            with profiling.phase('attach'):
+                _add_attachments(dest_issue, dest_jira, source_issue, conf)
         except JIRAError as e:
-            print('ERROR: attachment import failed with status',
+            _print('ERROR: attachment import failed with status',
                     e.status_code, '...', end=' ')
-            dest_jira.add_comment(dest_issue, '*Failed to import attachments*')
+            with profiling.phase('comment'):
+                dest_jira.add_comment(dest_issue, '*Failed to import attachments*')
+        _g_journal.record(source_issue.key, 'attachments')
 
     # Subtasks.
     if source_issue.fields.subtasks:
-        subtasks = [source_jira.issue(subtask.key) for subtask in
-                source_issue.fields.subtasks]
-        print('with', len(subtasks), 'subtasks ...', end=' ')
+        subtasks = _g_subtasks.pop(source_issue.key)
+        _print('with', len(subtasks), 'subtasks ...', end=' ')
         _make_dest_issues(source_jira, dest_jira, subtasks, conf, result, dest_issue, None)
 
     # Comments.
-    if source_issue.fields.comment.comments:
-        _add_comments(dest_issue, dest_jira, source_issue.fields.comment.comments)
-
-    comment = 'Imported from *[{1}|{0}/browse/{1}]*'.format(
-            source_jira._options['server'], source_issue.key)
-    dest_jira.add_comment(dest_issue, comment)
-
-    if conf.ADD_COMMENT_TO_OLD_ISSUE:
-        comment = 'Exported to *[{1}|{0}/browse/{1}]*'.format(
-                dest_jira._options['server'], dest_issue.key)
-        source_jira.add_comment(source_issue, comment)
+    with profiling.phase('comment'):
+        if source_issue.fields.comment.comments:
+            _add_comments(dest_issue, dest_jira, source_issue)
+
+        if not _g_journal.has(source_issue.key, 'imported-comment'):
+            comment = 'Imported from *[{1}|{0}/browse/{1}]*'.format(
+                    source_jira._options['server'], source_issue.key)
+            dest_jira.add_comment(dest_issue, comment)
+            _g_journal.record(source_issue.key, 'imported-comment')
+
+        if conf.ADD_COMMENT_TO_OLD_ISSUE and not _g_journal.has(source_issue.key, 'exported-comment'):
+            comment = 'Exported to *[{1}|{0}/browse/{1}]*'.format(
+                    dest_jira._options['server'], dest_issue.key)
+            source_jira.add_comment(source_issue, comment)
+            _g_journal.record(source_issue.key, 'exported-comment')
 
     # Portfolio epics.
     if portfolio_epics and _has_portfolio_epic_label(source_issue, conf):
@@ -97,26 +371,152 @@ def _map_issue(source_jira, dest_jira, source_issue, conf, result, parent, portf
     return dest_issue
 
 
+def _create_dest_issue(source_issue, conf, dest_jira, parent):
+    dest_issue = _g_bulk_created.pop(source_issue.key, None)
+    if dest_issue:
+        return dest_issue
+    # Resume a partially imported issue.
+    dest_issue_key = _g_journal.get(source_issue.key, 'created')
+    if dest_issue_key:
+        return dest_jira.issue(dest_issue_key)
+
+    fields = _get_dest_issue_fields(source_issue.fields, conf)
+    if parent:
+        fields['parent'] = {'key': parent.key}
+    _add_source_jira_issue_key(conf, fields, source_issue.key)
+    _map_versions(dest_jira, source_issue, fields, conf)
+
+    dest_issue = dest_jira.create_issue(fields=fields)
+    _g_journal.record(source_issue.key, 'created', dest_issue.key)
+    _g_imported[source_issue.key] = dest_issue
+    return dest_issue
+
+
+# Maps source issue keys to destination issues created in bulk
+# that are waiting for follow-up steps.
+_g_bulk_created = {}
+BULK_CREATE_BATCH_SIZE = 50
+
+def _bulk_create_dest_issues(dest_jira, source_issues, conf):
+    """
+    Creates destination issues for top-level source issues in batches and
+    returns the source issues that need follow-up steps. Issues that fail
+    to be created are reported and left out.
+    """
+    result = []
+    pending = []
+    for source_issue in source_issues:
+        if _g_journal.has(source_issue.key, 'created') or _is_imported(conf, source_issue.key):
+            result.append(source_issue)
+        else:
+            pending.append(source_issue)
+    failed = 0
+    for start in range(0, len(pending), BULK_CREATE_BATCH_SIZE):
+        batch = pending[start:start + BULK_CREATE_BATCH_SIZE]
+        field_list = []
+        for source_issue in batch:
+            fields = _get_dest_issue_fields(source_issue.fields, conf)
+            # Avoid project lookup for every issue in create_issues().
+            fields['project'] = {'key': conf.JIRA['project']}
+            _add_source_jira_issue_key(conf, fields, source_issue.key)
+            _map_versions(dest_jira, source_issue, fields, conf)
+            field_list.append(fields)
+        created = dest_jira.create_issues(field_list=field_list, prefetch=False)
+        for source_issue, item in zip(batch, created):
+            if item['status'] == 'Success':
+                dest_issue = item['issue']
+                _g_journal.record(source_issue.key, 'created', dest_issue.key)
+                _g_imported[source_issue.key] = dest_issue
+                _g_bulk_created[source_issue.key] = dest_issue
+                result.append(source_issue)
+            else:
+                failed += 1
+                print('ERROR: creating issue for', source_issue.key,
+                        'failed:', item['error'])
+    if pending:
+        print('Created', len(pending) - failed, 'issues in bulk,', failed, 'failed')
+    # Keep source order for follow-up steps.
+    created_keys = set(source_issue.key for source_issue in result)
+    return [source_issue for source_issue in source_issues
+            if source_issue.key in created_keys]
+
+
 def _map_sub_epics(source_jira, dest_jira, source_issue, dest_issue, conf, result):
-    print('with sub-epics:')
+    _print('with sub-epics:')
     # Get all linked sub-epics and import them recursively.
-    for linked_issue in source_issue.fields.issuelinks:
-        if linked_issue.type.name == conf.PORTFOLIO_EPIC_SUB_EPIC_SOURCE_LINK_NAME and hasattr(linked_issue, 'outwardIssue'):
-            sub_epic = linked_issue.outwardIssue
-            new_sub_epic = _map_issue(source_jira, dest_jira, sub_epic, conf, result, None, True)
-            dest_jira.create_issue_link(type=conf.PORTFOLIO_EPIC_SUB_EPIC_TARGET_LINK_NAME,
-                    inwardIssue=dest_issue.key,
-                    outwardIssue=new_sub_epic.key)
+    sub_epic_keys = [linked_issue.outwardIssue.key for linked_issue in source_issue.fields.issuelinks
+            if linked_issue.type.name == conf.PORTFOLIO_EPIC_SUB_EPIC_SOURCE_LINK_NAME
+            and hasattr(linked_issue, 'outwardIssue')]
+    if sub_epic_keys:
+        sub_epics = _fetch_source_issues(source_jira, 'key in ({})'.format(','.join(sub_epic_keys)))
+        sub_epics = dict((sub_epic.key, sub_epic) for sub_epic in sub_epics)
+        for sub_epic_key in sub_epic_keys:
+            sub_epic = sub_epics[sub_epic_key]
+            with _issue_lock(sub_epic.key):
+                if _g_journal.has(sub_epic.key, 'done'):
+                    new_sub_epic_key = _g_journal.get(sub_epic.key, 'created')
+                else:
+                    new_sub_epic_key = _map_issue(source_jira, dest_jira, sub_epic, conf, result, None, True).key
+                    _g_journal.record(sub_epic.key, 'done')
+            step = 'sub-epic-link:' + sub_epic.key
+            if not _g_journal.has(source_issue.key, step):
+                with profiling.phase('link'):
+                    dest_jira.create_issue_link(type=conf.PORTFOLIO_EPIC_SUB_EPIC_TARGET_LINK_NAME,
+                            inwardIssue=dest_issue.key,
+                            outwardIssue=new_sub_epic_key)
+                _g_journal.record(source_issue.key, step)
             # TODO: add portfolio epic label to target
-    print('Sub-epics of', source_issue.key, 'done.')
+    _print('Sub-epics of', source_issue.key, 'done.')
 
 
-def _already_imported(conf, dest_jira, issue_key):
+# Maps source issue keys to already imported destination issues.
+_g_imported = {}
+
+def _load_imported_issues(conf, dest_jira):
+    _g_imported.clear()
+    if not conf.CUSTOM_FIELD_FOR_SOURCE_JIRA_ISSUE_KEY:
+        return
+    # A resumed migration knows the issues it has imported from the journal,
+    # the destination is searched only when the journal is new.
+    if len(_g_journal):
+        return
+    field_name, field_id = conf.CUSTOM_FIELD_FOR_SOURCE_JIRA_ISSUE_KEY
+    query = "'{}' is not EMPTY".format(field_name)
+    for dest_issue in search.iter_issues(dest_jira, query, fields=field_id):
+        source_issue_key = getattr(dest_issue.fields, field_id, None)
+        if source_issue_key:
+            _g_imported[source_issue_key.strip()] = dest_issue
+    print('Found', len(_g_imported), 'previously imported issues')
+
+
+def _already_imported(conf, issue_key):
     if conf.CUSTOM_FIELD_FOR_SOURCE_JIRA_ISSUE_KEY:
-        # TODO: make the ~ operator configurable as well
-        return dest_jira.search_issues("'{}' ~ '{}'".format(
-            conf.CUSTOM_FIELD_FOR_SOURCE_JIRA_ISSUE_KEY[0], issue_key))
-    return False
+        return _g_imported.get(issue_key)
+    return None
+
+
+def _is_imported(conf, issue_key):
+    # Issues that have been created but not completed in the journal are resumed.
+    if _g_journal.has(issue_key, 'created'):
+        return _g_journal.has(issue_key, 'done')
+    return _already_imported(conf, issue_key) is not None
+
+
+def _get_dest_issue_key(conf, issue_key):
+    dest_issue_key = _g_journal.get(issue_key, 'created')
+    if dest_issue_key is None:
+        dest_issue = _already_imported(conf, issue_key)
+        dest_issue_key = dest_issue.key if dest_issue else None
+    return dest_issue_key
+
+
+_g_journal = None
+
+def _open_journal(journal_file):
+    global _g_journal
+    _g_journal = MigrationJournal(journal_file or ':memory:')
+    if len(_g_journal):
+        print('Resuming from journal', journal_file, 'with', len(_g_journal), 'issues')
 
 
 def _add_source_jira_issue_key(conf, fields, issue_key):
@@ -129,10 +529,13 @@ def _map_versions(dest_jira, source_issue, fields, conf):
     if source_versions is not None:
         target_versions = []
         for version in source_versions:
-            # We create the current version if it does not exist in the target JIRA project.
-            target_version = _get_target_version_by_name(dest_jira, conf, getattr(version, 'name'))
-            if target_version is None:
-                target_version = dest_jira.create_version(getattr(version, 'name'), conf.JIRA['project'])
+            name = getattr(version, 'name')
+            with _g_versions_lock:
+                # We create the current version if it does not exist in the target JIRA project.
+                target_version = _get_target_version_by_name(name)
+                if target_version is None:
+                    target_version = dest_jira.create_version(name, conf.JIRA['project'])
+                    _g_versions[name] = target_version
 
             target_versions.append({'id': getattr(target_version, 'id')})
 
@@ -144,20 +547,24 @@ def _has_portfolio_epic_label(source_issue, conf):
     return conf.PORTFOLIO_EPIC_LABEL in source_issue.fields.labels
 
 
-def _get_target_version_by_name(jira, conf, name):
+# Maps version names to versions of the target project.
+_g_versions = {}
+_g_versions_lock = threading.Lock()
+
+def _load_project_versions(conf, dest_jira):
+    _g_versions.clear()
+    for version in dest_jira.project_versions(conf.JIRA['project']):
+        _g_versions.setdefault(getattr(version, 'name'), version)
+
+
+def _get_target_version_by_name(name):
     """
-    Get an existing version by name for the current project.
+    Get an existing version by name for the current project from the
+    versions loaded at the start of the run.
 
-    :param jira: current jira resource
-    :param conf: JIRA configurations
     :param name: name of the version to check
     """
-    versions = jira.project_versions(conf.JIRA['project'])
-    for version in versions:
-        if getattr(version, 'name') == name:
-            return version
-
-    return None
+    return _g_versions.get(name)
 
 
 def _get_dest_issue_fields(fields, conf):
@@ -170,18 +577,7 @@ def _get_dest_issue_fields(fields, conf):
     for fieldname in ('priority', 'issuetype', 'assignee', 'reporter'):
         value = getattr(fields, fieldname)
         if value:
-            value = getattr(value, 'name')
-            fieldname_map = getattr(conf, fieldname.upper() + '_MAP')
-            if value in fieldname_map:
-                mapped_value = fieldname_map[value]
-            else:
-                try:
-                    mapped_value = getattr(conf, 'DEFAULT_' + fieldname.upper())
-                except AttributeError:
-                    raise AttributeError("Failed to find '%(value)s' in "
-                            '%(fieldname)s_MAP and DEFAULT_%(fieldname)s is not set' %
-                            {'value': value, 'fieldname': fieldname.upper()})
-            result[fieldname] = {'name': mapped_value}
+            result[fieldname] = {'name': _map_name(fieldname, value, conf)}
     if conf.CUSTOM_FIELD:
         result[conf.CUSTOM_FIELD[0]] = conf.CUSTOM_FIELD[1]
     if conf.CUSTOM_FIELD_MAP:
@@ -193,38 +589,86 @@ def _get_dest_issue_fields(fields, conf):
     return result
 
 
+def _map_name(fieldname, value, conf):
+    value = getattr(value, 'name')
+    fieldname_map = getattr(conf, fieldname.upper() + '_MAP')
+    if value in fieldname_map:
+        return fieldname_map[value]
+    try:
+        return getattr(conf, 'DEFAULT_' + fieldname.upper())
+    except AttributeError:
+        raise AttributeError("Failed to find '%(value)s' in "
+                '%(fieldname)s_MAP and DEFAULT_%(fieldname)s is not set' %
+                {'value': value, 'fieldname': fieldname.upper()})
+
+
+# Maps source epic keys to destination epic keys.
 _g_epic_map = {}
+# Reentrant, as migrating an issue can import its epic or sub-epics.
+_g_issue_locks = collections.defaultdict(threading.RLock)
+_g_issue_locks_lock = threading.Lock()
 
 def _set_epic_link(dest_issue, source_issue, conf, source_jira, dest_jira):
     source_epic_key = getattr(source_issue.fields, conf.SOURCE_EPIC_LINK_FIELD_ID)
     if not source_epic_key:
         return
-    global _g_epic_map
-    if source_epic_key not in _g_epic_map:
-        target_epic = _already_imported(conf, dest_jira, source_epic_key)
-        if target_epic:
-            print('epic {} has already been imported, skipping...'.format(source_epic_key), end=' ')
-            target_epic = target_epic[0]
-        else:
-            print('importing epic {} ...'.format(source_epic_key), end=' ')
-            source_epic = source_jira.issue(source_epic_key)
-            epic_fields = _get_dest_issue_fields(source_epic.fields, conf)
-            epic_fields[conf.TARGET_EPIC_NAME_FIELD_ID] = getattr(
-                    source_epic.fields, conf.SOURCE_EPIC_NAME_FIELD_ID)
-            _add_source_jira_issue_key(conf, epic_fields, source_epic_key)
-            target_epic = dest_jira.create_issue(fields=epic_fields)
-        _g_epic_map[source_epic_key] = target_epic
-    target_epic = _g_epic_map[source_epic_key]
-    dest_jira.add_issues_to_epic(target_epic.key, [dest_issue.key])
-    print('linked to epic', target_epic.key, '...', end=' ')
+    # Workers that need the same epic wait here so that it is created only once,
+    # also while another worker migrates it as a top-level issue.
+    with _issue_lock(source_epic_key):
+        if source_epic_key not in _g_epic_map:
+            target_epic_key = _get_dest_issue_key(conf, source_epic_key)
+            if target_epic_key:
+                _print('epic {} has already been imported, skipping...'.format(source_epic_key), end=' ')
+            else:
+                _print('importing epic {} ...'.format(source_epic_key), end=' ')
+                with profiling.phase('fetch'):
+                    source_epic = source_jira.issue(source_epic_key)
+                epic_fields = _get_dest_issue_fields(source_epic.fields, conf)
+                epic_fields[conf.TARGET_EPIC_NAME_FIELD_ID] = getattr(
+                        source_epic.fields, conf.SOURCE_EPIC_NAME_FIELD_ID)
+                _add_source_jira_issue_key(conf, epic_fields, source_epic_key)
+                with profiling.phase('create'):
+                    target_epic = dest_jira.create_issue(fields=epic_fields)
+                _g_journal.record(source_epic_key, 'created', target_epic.key)
+                # The epic is complete, it is skipped when it is met as a
+                # top-level issue later.
+                _g_journal.record(source_epic_key, 'done')
+                _g_imported[source_epic_key] = target_epic
+                target_epic_key = target_epic.key
+            _g_epic_map[source_epic_key] = target_epic_key
+    target_epic_key = _g_epic_map[source_epic_key]
+    with profiling.phase('link'):
+        dest_jira.add_issues_to_epic(target_epic_key, [dest_issue.key])
+    _print('linked to epic', target_epic_key, '...', end=' ')
+
+
+def _issue_lock(source_key):
+    with _g_issue_locks_lock:
+        return _g_issue_locks[source_key]
 
 
 def _set_status(dest_issue, source_issue, conf, dest_jira):
+    issue_type, transitions = _get_transitions(source_issue, conf)
+    for step, transition_name in enumerate(transitions):
+        journal_step = 'transition:{}'.format(step)
+        if _g_journal.has(source_issue.key, journal_step):
+            continue
+        transition_id = _get_transition_id(dest_jira, dest_issue, issue_type, transitions, step, conf)
+        if isinstance(transition_name, conf.WithResolution):
+            resolution = conf.RESOLUTION_MAP[source_issue.fields.resolution.name]
+            dest_jira.transition_issue(dest_issue, transition_id,
+                    fields={'resolution': {'name': resolution}})
+        else:
+            dest_jira.transition_issue(dest_issue, transition_id)
+        _g_journal.record(source_issue.key, journal_step)
+
+
+def _get_transitions(source_issue, conf):
     # Do nothing if status transitions are disabled.
     if not conf.STATUS_TRANSITIONS:
-        return
+        return None, ()
 
-    issue_type = dest_issue.fields.issuetype.name
+    issue_type = _map_name('issuetype', source_issue.fields.issuetype, conf)
     status_name = source_issue.fields.status.name
 
     transitions = None
@@ -239,34 +683,119 @@ def _set_status(dest_issue, source_issue, conf, dest_jira):
 
     transitions = transition_map[status_name]
     if not transitions:
-        return
+        return issue_type, ()
     # Allow single string and WithResolution values by converting them to a tuple.
     if isinstance(transitions, str) or isinstance(transitions, conf.WithResolution):
         transitions = (transitions,)
+    return issue_type, tuple(transitions)
 
-    for transition_name in transitions:
-        if isinstance(transition_name, conf.WithResolution):
-            resolution = conf.RESOLUTION_MAP[source_issue.fields.resolution.name]
-            dest_jira.transition_issue(dest_issue, transition_name.transition_name,
-                    fields={'resolution': {'name': resolution}})
-        else:
-            dest_jira.transition_issue(dest_issue, transition_name)
 
+# Maps (issue type, transitions up to and including the workflow step)
+# to transition IDs, as resolving transition names requires fetching
+# the available transitions of the issue.
+_g_transition_ids = {}
 
-def _add_comments(issue, jira, comments):
-    for comment in comments:
+def _get_transition_id(dest_jira, dest_issue, issue_type, transitions, step, conf):
+    key = (issue_type, tuple(transitions[:step + 1]))
+    transition_id = _g_transition_ids.get(key)
+    if transition_id is None:
+        transition_name = transitions[step]
+        if isinstance(transition_name, conf.WithResolution):
+            transition_name = transition_name.transition_name
+        transition_id = dest_jira.find_transitionid_by_name(dest_issue, transition_name)
+        if transition_id is None:
+            # Let transition_issue() report the invalid transition name.
+            return transition_name
+        transition_id = str(transition_id)
+        _g_transition_ids[key] = transition_id
+    return transition_id
+
+
+def _get_source_worklogs(source_jira, source_issue):
+    worklog = source_issue.fields.worklog
+    # Issues include only the first page of worklogs, fetch all if there are more.
+    if getattr(worklog, 'total', 0) > len(worklog.worklogs):
+        return source_jira.worklogs(source_issue.key)
+    return worklog.worklogs
+
+
+def _add_comments(issue, jira, source_issue):
+    for comment in source_issue.fields.comment.comments:
+        step = 'comment:' + comment.id
+        if _g_journal.has(source_issue.key, step):
+            continue
         jira.add_comment(issue, u"*Comment by {0}*:\n{1}"
                 .format(comment.author.displayName, comment.body))
+        _g_journal.record(source_issue.key, step)
+
+
+# Attachments up to this size are kept in memory during transfer,
+# larger ones are spooled to a temporary file.
+DEFAULT_ATTACHMENT_SPOOL_SIZE = 10 * 1024 * 1024
+_ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
+def _add_attachments(issue, jira, source_issue, conf):
+    spool_size = getattr(conf, 'ATTACHMENT_SPOOL_SIZE', DEFAULT_ATTACHMENT_SPOOL_SIZE)
+    for attachment in source_issue.fields.attachment:
+        step = 'attachment:' + attachment.id
+        if _g_journal.has(source_issue.key, step):
+            continue
+        size = getattr(attachment, 'size', 0) or 0
+        with _g_attachment_budget.reserve(size):
+            with (BytesIO() if size <= spool_size else tempfile.TemporaryFile()) as buf:
+                for chunk in attachment.iter_content(_ATTACHMENT_CHUNK_SIZE):
+                    buf.write(chunk)
+                buf.seek(0)
+                jira.add_attachment(issue,
+                        filename=_normalize_filename(attachment.filename),
+                        attachment=buf)
+        _g_journal.record(source_issue.key, step)
+
+
+class _ByteBudget(object):
+    """
+    Limits the total size of attachments that are being transferred at the
+    same time. An attachment that is larger than the limit is transferred
+    alone.
+    """
+
+    def __init__(self, limit=None):
+        self._limit = limit
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, size):
+        if not self._limit:
+            yield
+            return
+        size = min(size, self._limit)
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight + size <= self._limit)
+            self._in_flight += size
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= size
+                self._condition.notify_all()
+
+
+_g_attachment_budget = _ByteBudget()
+
+def _init_attachment_budget(conf):
+    global _g_attachment_budget
+    _g_attachment_budget = _ByteBudget(getattr(conf, 'ATTACHMENT_MAX_IN_FLIGHT_BYTES', None))
+
 
+_g_output = threading.local()
 
-def _add_attachments(issue, jira, attachments):
-    for attachment in attachments:
-        with BytesIO() as buf:
-            for chunk in attachment.iter_content():
-                buf.write(chunk)
-            jira.add_attachment(issue,
-                    filename=_normalize_filename(attachment.filename),
-                    attachment=buf)
+def _print(*args, **kwargs):
+    # Print to the per-issue buffer when running in a worker thread.
+    buffer = getattr(_g_output, 'buffer', None)
+    if buffer is not None:
+        kwargs['file'] = buffer
+    print(*args, **kwargs)
 
 
 def _normalize_filename(value):
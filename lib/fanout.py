@@ -0,0 +1,94 @@
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from . import search
+from . import throttling
+
+DEFAULT_CONCURRENCY = 4
+
+
+def run_concurrently(calls, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Runs the given functions without arguments with at most concurrency of
+    them in flight and returns their results in the order of the calls.
+    The functions run in threads so that they can use the blocking JIRA
+    client, the first exception raised by a function is re-raised.
+    """
+    calls = list(calls)
+    if concurrency <= 1 or len(calls) <= 1:
+        return [call() for call in calls]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return asyncio.run(_gather(calls, concurrency, executor))
+
+
+async def _gather(calls, concurrency, executor):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(call):
+        async with semaphore:
+            return await loop.run_in_executor(executor, call)
+
+    return await asyncio.gather(*[run(call) for call in calls])
+
+
+def iter_concurrently(calls, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Yields the results of the given functions in the order of the calls as
+    soon as each of them is available, running at most concurrency of them
+    ahead of the consumer. Calls are taken lazily from the iterable.
+    """
+    if concurrency <= 1:
+        for call in calls:
+            yield call()
+        return
+    calls = iter(calls)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = collections.deque()
+        try:
+            for call in calls:
+                pending.append(executor.submit(call))
+                if len(pending) >= concurrency:
+                    yield pending.popleft().result()
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def configure(jira, concurrency):
+    """Sizes the connection pool of the JIRA client for concurrent requests."""
+    if concurrency > 1:
+        throttling.set_pool_size(jira._session, concurrency)
+
+
+def iter_issues(jira, query, fields=None, expand=None,
+                page_size=search.DEFAULT_PAGE_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Yields all issues that match the given JQL query like search.iter_issues,
+    but fetches the pages after the first one concurrently once the total
+    result count is known.
+    """
+    first_page = jira.search_issues(query, startAt=0, maxResults=page_size,
+                                    fields=fields, expand=expand)
+    for issue in first_page:
+        yield issue
+    if not first_page or len(first_page) >= first_page.total:
+        return
+
+    def fetch_page(start_at):
+        return lambda: jira.search_issues(query, startAt=start_at, maxResults=page_size,
+                                          fields=fields, expand=expand)
+
+    # Fetch a batch of pages at a time to keep memory use bounded.
+    page_starts = list(range(len(first_page), first_page.total, len(first_page)))
+    for batch_start in range(0, len(page_starts), concurrency):
+        batch = page_starts[batch_start:batch_start + concurrency]
+        for page in run_concurrently([fetch_page(start_at) for start_at in batch],
+                                     concurrency):
+            for issue in page:
+                yield issue
@@ -1,32 +1,57 @@
 from __future__ import print_function
+import collections
 import httplib2
+import json
 import re
 import os
 import sys
+import time
 import datetime
 from datetime import timezone
+import functools
 from functools import total_ordering
+from io import StringIO
 
 import dateutil.parser
 import pytz
 
 from jira.exceptions import JIRAError
 
+from . import fanout
+
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 
 
+EVENTS_PAGE_SIZE = 250
+
+DEFAULT_SYNC_TOKEN_FILE = os.path.join('~', '.credentials', 'ask-jira-sync-tokens.json')
+
+DEFAULT_CALENDAR_ID_FILE = os.path.join('~', '.credentials', 'ask-jira-calendars.json')
+DEFAULT_CALENDAR_ID_TTL = 24 * 60 * 60
+
+# Credentials are refreshed when they expire in less than this.
+CREDENTIALS_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
 class WorklogParseError(RuntimeError):
     pass
 
 
-def import_worklogs(jira, jira_user, worklogconfig, calendar_name, from_day, to_day):
+def import_worklogs(jira, jira_user, worklogconfig, calendar_name, from_day, to_day,
+                    concurrency=fanout.DEFAULT_CONCURRENCY, incremental=False, workers=1):
     """
     Imports worklogs using the Google Calendar API and sumbits them to JIRA.
     Calendar entries must start with JIRA issue IDs opitionally followed by
-    ':' and comments. Returns total hours logged as timedelta.
+    ':' and comments. Events are processed page by page, existing JIRA
+    worklogs of up to concurrency issues are fetched in parallel and
+    worklogs of up to workers issues are submitted in parallel. In
+    incremental mode only the events changed since the previous incremental
+    import of the calendar are fetched. Returns total hours logged as
+    timedelta.
     """
     if from_day >= to_day:
         print('Start date must be before end date, start:', from_day, 'end:', to_day)
@@ -35,51 +60,224 @@ def import_worklogs(jira, jira_user, worklogconfig, calendar_name, from_day, to_
     from_day = _convert_to_datestring(from_day, worklogconfig)
     to_day = _convert_to_datestring(to_day, worklogconfig)
     service = _get_calendar_service(worklogconfig)
-    calendarId = _get_calendar_id(service, calendar_name)
-
-    eventsResult = service.events().list(calendarId=calendarId, timeMin=from_day, timeMax=to_day,
-                                         maxResults=1000, singleEvents=True, orderBy='startTime').execute()
-    events = eventsResult.get('items', [])
-
-    if not events:
-        print('No events found in calendar', calendar_name, 'during', from_day, '-', to_day)
-        return 0
+    calendarId = _get_calendar_id(service, calendar_name, worklogconfig)
+
+    sync_tokens = None
+    sync_token = None
+    # Sync requests can not be limited to the date range, so changed events
+    # outside the range are skipped. The token is stored per date range so
+    # that the skipped events are fetched by a full sync of another range.
+    sync_key = ' '.join((calendarId, from_day, to_day))
+    if incremental:
+        sync_tokens = _JsonFile(getattr(worklogconfig, 'SYNC_TOKEN_FILE',
+                                        DEFAULT_SYNC_TOKEN_FILE))
+        sync_token = sync_tokens.get(sync_key)
+        if sync_token:
+            print('** Fetching events changed since the previous import')
+        else:
+            print('** No previous incremental import of the date range, fetching all events')
 
-    durations = []
     prefix_filter = worklogconfig.WORKLOG_PREFIX_FILTER if hasattr(worklogconfig,
             'WORKLOG_PREFIX_FILTER') and worklogconfig.WORKLOG_PREFIX_FILTER else None
     if prefix_filter:
         print('** Filtering worklogs by prefix', prefix_filter)
-        events = [event for event in events if
-                event['summary'].startswith(prefix_filter)]
+
+    durations = []
+    issue_worklogs = {}
+    event_count = 0
+    failed = False
+    next_sync_token = None
+    for page in _iter_event_pages(service, calendarId, from_day, to_day, sync_token):
+        next_sync_token = page.get('nextSyncToken')
+        events = [event for event in page.get('items', [])
+                  if event.get('status') != 'cancelled']
+        if sync_token:
+            events = [event for event in events if _is_in_range(event, from_day, to_day)]
+        event_count += len(events)
+        if prefix_filter:
+            events = [event for event in events if
+                    event['summary'].startswith(prefix_filter)]
+        failed |= _import_events(jira, jira_user, worklogconfig, events,
+                                 issue_worklogs, durations, concurrency, workers)
+
+    if not event_count:
+        print('No events found in calendar', calendar_name, 'during', from_day, '-', to_day)
+
+    # The token is kept when JIRA failed so that the events are retried.
+    if incremental and next_sync_token and not failed:
+        sync_tokens.set(sync_key, next_sync_token)
+
+    return sum(durations, datetime.timedelta(0))
+
+
+def _import_events(jira, jira_user, worklogconfig, events, issue_worklogs, durations,
+                   concurrency, workers):
+    """Logs the events of one page, returns True when a JIRA request failed."""
+    gcal_worklogs = []
     for event in events:
         try:
-            gcal_worklog = Worklog.from_gcal(event, worklogconfig.JIRA_TIMEZONE)
-            jira_worklogs = [Worklog.from_jira(w)
-                    for w in jira.worklogs(gcal_worklog.issue)
-                    if w.author.name == jira_user]
-            if (jira_worklogs and gcal_worklog in jira_worklogs):
-                jira_worklog = next(w for w in jira_worklogs if w == gcal_worklog)
-                if gcal_worklog.duration != jira_worklog.duration:
-                    raise WorklogParseError('Google worklog for issue %s '
-                                            'starting at %s: duration %s differs from JIRA duration %s'
-                                            % (gcal_worklog.issue, gcal_worklog.start,
-                                               gcal_worklog.duration, jira_worklog.duration))
-                print(gcal_worklog.duration, 'hours starting', gcal_worklog.start,
-                      'already logged for', gcal_worklog.issue)
-            else:
-                print('Logging', gcal_worklog.duration, 'hours starting', gcal_worklog.start, 'for', gcal_worklog.issue)
-                jira.add_worklog(issue=gcal_worklog.issue,
-                                 timeSpentSeconds=gcal_worklog.duration.seconds,
-                                 started=gcal_worklog.start,
-                                 comment=gcal_worklog.comment)
-                durations.append(gcal_worklog.duration)
+            gcal_worklogs.append(Worklog.from_gcal(event, worklogconfig.JIRA_TIMEZONE))
         except WorklogParseError as e:
-            print(e)
+            gcal_worklogs.append(e)
+    # Worklogs are fetched once per issue, the user's worklogs of each
+    # issue are indexed by start time.
+    issues = sorted(set(w.issue for w in gcal_worklogs if isinstance(w, Worklog)
+                        and w.issue not in issue_worklogs))
+    issue_worklogs.update(zip(issues, fanout.run_concurrently(
+            [_fetch_worklogs(jira, issue, jira_user) for issue in issues], concurrency)))
+
+    # The events of an issue are logged in order by a single worker, so each
+    # of them is checked against the worklogs logged before it. Output is
+    # collected per event and printed in event order.
+    outputs = [None] * len(gcal_worklogs)
+    issue_positions = collections.OrderedDict()
+    for position, gcal_worklog in enumerate(gcal_worklogs):
+        if isinstance(gcal_worklog, WorklogParseError):
+            outputs[position] = str(gcal_worklog) + '\n'
+        else:
+            issue_positions.setdefault(gcal_worklog.issue, []).append(position)
+
+    def import_issue_worklogs(issue):
+        def run():
+            results = []
+            for position in issue_positions[issue]:
+                output = StringIO()
+                results.append((position, output) + _import_worklog(jira,
+                        gcal_worklogs[position], issue_worklogs[issue], output))
+            return results
+        return run
+
+    failed = False
+    for results in fanout.run_concurrently(
+            [import_issue_worklogs(issue) for issue in issue_positions], workers):
+        for position, output, duration, error in results:
+            outputs[position] = output.getvalue()
+            if duration is not None:
+                durations.append(duration)
+            failed |= error
+    sys.stdout.write(''.join(outputs))
+    sys.stdout.flush()
+    return failed
+
+
+def _import_worklog(jira, gcal_worklog, jira_worklogs, output):
+    """
+    Logs the worklog unless it has been logged already, returns the logged
+    duration or None and whether a JIRA request failed.
+    """
+    try:
+        if isinstance(jira_worklogs, JIRAError):
+            raise jira_worklogs
+        jira_worklog = jira_worklogs.get(gcal_worklog.start)
+        if jira_worklog is not None:
+            if gcal_worklog.duration != jira_worklog.duration:
+                raise WorklogParseError('Google worklog for issue %s '
+                                        'starting at %s: duration %s differs from JIRA duration %s'
+                                        % (gcal_worklog.issue, gcal_worklog.start,
+                                           gcal_worklog.duration, jira_worklog.duration))
+            print(gcal_worklog.duration, 'hours starting', gcal_worklog.start,
+                  'already logged for', gcal_worklog.issue, file=output)
+            return None, False
+        print('Logging', gcal_worklog.duration, 'hours starting', gcal_worklog.start,
+              'for', gcal_worklog.issue, file=output)
+        jira.add_worklog(issue=gcal_worklog.issue,
+                         timeSpentSeconds=gcal_worklog.duration.seconds,
+                         started=gcal_worklog.start,
+                         comment=gcal_worklog.comment)
+        # Later events of the same issue are checked against it too.
+        jira_worklogs[gcal_worklog.start] = gcal_worklog
+        return gcal_worklog.duration, False
+    except WorklogParseError as e:
+        print(e, file=output)
+        return None, False
+    except JIRAError as e:
+        print("Issue '" + gcal_worklog.issue + "' does not exist (or other JIRA error):", e,
+              file=output)
+        return None, True
+
+
+def _iter_event_pages(service, calendarId, from_day, to_day, sync_token=None):
+    """
+    Yields the pages of events of the calendar, the last one has the
+    nextSyncToken. With a sync token only the events changed since the sync
+    are returned, a full sync of the date range is made when it has expired.
+    """
+    if sync_token:
+        params = dict(syncToken=sync_token)
+    else:
+        # orderBy can not be used with sync tokens, results of incremental
+        # syncs are in arbitrary order anyway.
+        params = dict(timeMin=from_day, timeMax=to_day, orderBy='startTime')
+    page_token = None
+    while True:
+        try:
+            page = service.events().list(calendarId=calendarId, singleEvents=True,
+                                         maxResults=EVENTS_PAGE_SIZE, pageToken=page_token,
+                                         **params).execute()
+        except HttpError as e:
+            if not sync_token or e.resp.status != 410:
+                raise
+            print('** Calendar sync token has expired, fetching all events')
+            for page in _iter_event_pages(service, calendarId, from_day, to_day):
+                yield page
+            return
+        yield page
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def _is_in_range(event, from_day, to_day):
+    start = event['start'].get('dateTime')
+    end = event['end'].get('dateTime')
+    if not start or not end:
+        return True
+    return (_parse_iso_date(start) < _parse_iso_date(to_day) and
+            _parse_iso_date(end) > _parse_iso_date(from_day))
+
+
+class _JsonFile(object):
+    """Values by key, stored in a JSON file."""
+
+    def __init__(self, path):
+        self._path = os.path.expanduser(path)
+        self._values = {}
+        if os.path.exists(self._path):
+            with open(self._path) as f:
+                self._values = json.load(f)
+
+    def get(self, key):
+        return self._values.get(key)
+
+    def set(self, key, value):
+        self._values[key] = value
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._values, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self._path)
+
+
+def _fetch_worklogs(jira, issue, jira_user):
+    # Errors are returned instead of raised to report them in event order.
+    def fetch():
+        try:
+            return _index_worklogs(jira.worklogs(issue), jira_user)
         except JIRAError as e:
-            print("Issue '" + gcal_worklog.issue + "' does not exist (or other JIRA error):", e)
+            return e
+    return fetch
 
-    return sum(durations, datetime.timedelta(0))
+
+def _index_worklogs(jira_worklogs, jira_user):
+    """Returns the worklogs of the user by start time, the first one wins."""
+    index = {}
+    for jira_worklog in jira_worklogs:
+        if jira_worklog.author.name == jira_user:
+            worklog = Worklog.from_jira(jira_worklog)
+            index.setdefault(worklog.start, worklog)
+    return index
 
 
 JIRA_ISSUE_REGEX = re.compile('[A-Z\d]+-\d+')
@@ -93,7 +291,6 @@ class Worklog(object):
         start = _parse_iso_date(event['start'].get('dateTime'))
         end = _parse_iso_date(event['end'].get('dateTime'))
         duration = end - start
-        summary = event['summary']
         summary = event['summary'].split(':', 1)
         issue = summary[0].strip()
         if not JIRA_ISSUE_REGEX.match(issue):
@@ -107,10 +304,10 @@ class Worklog(object):
         # see https://jira.atlassian.com/browse/JRASERVER-25855, so it has to
         # be manually subtracted.
         if jira_timezone:
-            jira_tz = pytz.timezone(jira_timezone)
-            start_localized = jira_tz.localize(start.replace(tzinfo=None))
-            start = start_localized.astimezone(timezone.utc)
-            if start_localized.dst():
+            start = start.replace(tzinfo=None)
+            utc_offset, dst = _get_utc_offset_and_dst(jira_timezone, start)
+            start = (start - utc_offset).replace(tzinfo=timezone.utc)
+            if dst:
                 start -= datetime.timedelta(hours=1)
 
         return Worklog(start, duration, issue, comment)
@@ -121,6 +318,8 @@ class Worklog(object):
         duration = datetime.timedelta(seconds=jira_worklog.timeSpentSeconds)
         return Worklog(start, duration)
 
+    __slots__ = ('start', 'duration', 'issue', 'comment')
+
     def __init__(self, start, duration, issue=None, comment=None):
         self.start = start
         self.duration = duration
@@ -140,12 +339,35 @@ def _convert_to_datestring(datestr, conf):
     return datetime.datetime.strptime(datestr, '%Y-%m-%d').isoformat() + conf.TIMEZONE
 
 
+_g_calendar_services = {}
+
 def _get_calendar_service(conf):
-    credentials = _get_credentials(conf)
-    return build('calendar', 'v3', credentials=credentials)
+    # The service is reused by later imports in the same process, like in
+    # daemon mode, its credentials are refreshed by the transport when needed.
+    # The discovery document of the API comes with the client library.
+    service = _g_calendar_services.get(conf.CREDENTIAL_FILE)
+    if service is None:
+        credentials = _get_credentials(conf)
+        service = build('calendar', 'v3', credentials=credentials,
+                        static_discovery=True, cache_discovery=False)
+        _g_calendar_services[conf.CREDENTIAL_FILE] = service
+    return service
+
+
+def _get_calendar_id(service, calendar_name, conf):
+    ttl = getattr(conf, 'CALENDAR_ID_TTL', DEFAULT_CALENDAR_ID_TTL)
+    if not ttl:
+        return _find_calendar_id(service, calendar_name)
+    calendar_ids = _JsonFile(getattr(conf, 'CALENDAR_ID_FILE', DEFAULT_CALENDAR_ID_FILE))
+    cached = calendar_ids.get(calendar_name)
+    if cached and time.time() - cached['stored'] < ttl:
+        return cached['id']
+    calendarId = _find_calendar_id(service, calendar_name)
+    calendar_ids.set(calendar_name, {'id': calendarId, 'stored': time.time()})
+    return calendarId
 
 
-def _get_calendar_id(service, calendar_name):
+def _find_calendar_id(service, calendar_name):
     calendars = service.calendarList().list().execute().get('items', [])
     calendarId = next((c['id'] for c in calendars
                        if c['summary'] == calendar_name), None)
@@ -155,14 +377,46 @@ def _get_calendar_id(service, calendar_name):
 
 
 def _parse_iso_date(datestr):
-    return dateutil.parser.parse(datestr)
+    # fromisoformat() parses the Google Calendar and JIRA formats since
+    # Python 3.11 and is much faster than dateutil.
+    try:
+        return datetime.datetime.fromisoformat(datestr)
+    except ValueError:
+        return dateutil.parser.parse(datestr)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_timezone(name):
+    return pytz.timezone(name)
+
+
+def _get_utc_offset_and_dst(timezone_name, local_time):
+    offsets = _get_day_utc_offset_and_dst(timezone_name, local_time.date())
+    if offsets is None:
+        localized = _get_timezone(timezone_name).localize(local_time)
+        return localized.utcoffset(), localized.dst()
+    return offsets
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_day_utc_offset_and_dst(timezone_name, day):
+    # Returns None for days when the offset changes, they are rare enough
+    # to localize each event separately.
+    tz = _get_timezone(timezone_name)
+    first = tz.localize(datetime.datetime.combine(day, datetime.time.min))
+    last = tz.localize(datetime.datetime.combine(day, datetime.time.max))
+    if (first.utcoffset(), first.dst()) != (last.utcoffset(), last.dst()):
+        return None
+    return first.utcoffset(), first.dst()
 
 
 def _get_credentials(conf):
     """Gets valid user credentials from storage.
 
-    If nothing has been stored, or if the stored credentials are invalid,
-    the OAuth2 flow is completed to obtain the new credentials.
+    Stored credentials are refreshed when they expire in less than
+    CREDENTIALS_REFRESH_MARGIN. If nothing has been stored, or if the stored
+    credentials can not be refreshed, the OAuth2 flow is completed to obtain
+    the new credentials.
 
     Returns:
         Credentials, the obtained credential.
@@ -170,8 +424,8 @@ def _get_credentials(conf):
     credentials = None
     if os.path.exists(conf.CREDENTIAL_FILE):
         credentials = Credentials.from_authorized_user_file(conf.CREDENTIAL_FILE, conf.SCOPES)
-    if not credentials or not credentials.valid:
-        if credentials and credentials.expired and credentials.refresh_token:
+    if not credentials or _expires_soon(credentials):
+        if credentials and credentials.refresh_token:
             credentials.refresh(Request())
         else:
             # avoid mess with argparse
@@ -183,3 +437,13 @@ def _get_credentials(conf):
         with open(conf.CREDENTIAL_FILE, 'w') as credentials_token:
             credentials_token.write(credentials.to_json())
     return credentials
+
+
+def _expires_soon(credentials):
+    if not credentials.token:
+        return True
+    if credentials.expiry is None:
+        return False
+    # Credentials expiry is a naive UTC datetime.
+    now = datetime.datetime.now(timezone.utc).replace(tzinfo=None)
+    return credentials.expiry - now < CREDENTIALS_REFRESH_MARGIN
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+
+# Time to live in seconds for GET responses of read-only endpoints,
+# responses of other endpoints are not cached.
+DEFAULT_TTLS = (
+    (r'/rest/api/\d+/serverInfo$', 24 * 60 * 60),
+    (r'/rest/api/\d+/field$', 24 * 60 * 60),
+    (r'/rest/api/\d+/project$', 60 * 60),
+    (r'/rest/api/\d+/issue/[^/]+/transitions$', 5 * 60),
+    (r'/rest/api/\d+/search$', 60),
+)
+
+_HEADERS_TO_STORE = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of GET responses from read-only JIRA endpoints, keyed by
+    URL and parameters. Expired responses are revalidated with ETag or
+    Last-Modified when the server provides them. The least recently used
+    responses are evicted when the cache grows over max_size bytes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, ttls=None, refresh=False):
+        self._directory = os.path.expanduser(directory)
+        self._max_size = max_size
+        self._ttls = [(re.compile(pattern), ttl) for pattern, ttl in
+                      list((ttls or {}).items()) + list(DEFAULT_TTLS)]
+        self._refresh = refresh
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+
+    def install(self, session):
+        """Serves GET requests of the given requests session from the cache."""
+        request = session.request
+
+        def cached_request(method, url, **kwargs):
+            ttl = self._get_ttl(url)
+            if method.upper() != 'GET' or ttl is None or kwargs.get('stream'):
+                return request(method, url, **kwargs)
+            return self._get(request, method, url, ttl, kwargs)
+
+        session.request = cached_request
+
+    def _get_ttl(self, url):
+        path = url.split('?', 1)[0]
+        for pattern, ttl in self._ttls:
+            if pattern.search(path):
+                return ttl
+        return None
+
+    def _get(self, request, method, url, ttl, kwargs):
+        key = hashlib.sha256(json.dumps([url, kwargs.get('params')], sort_keys=True,
+                                        default=str).encode('utf-8')).hexdigest()
+        path = os.path.join(self._directory, key)
+        entry = None if self._refresh else self._load(path)
+        if entry and time.time() - entry['stored'] < ttl:
+            try:
+                os.utime(path + '.json')
+                return self._to_response(entry, path)
+            except OSError:
+                # Evicted by another process after it was loaded, a miss.
+                entry = None
+
+        headers = kwargs.get('headers')
+        if entry:
+            conditional_headers = dict(headers or {})
+            if entry['headers'].get('ETag'):
+                conditional_headers['If-None-Match'] = entry['headers']['ETag']
+            if entry['headers'].get('Last-Modified'):
+                conditional_headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+            kwargs['headers'] = conditional_headers
+        response = request(method, url, **kwargs)
+        if entry and response.status_code == 304:
+            try:
+                cached_response = self._to_response(entry, path)
+            except OSError:
+                # Evicted during revalidation, fetch the response again.
+                kwargs['headers'] = headers
+                response = request(method, url, **kwargs)
+            else:
+                entry['stored'] = time.time()
+                self._store_entry(path, entry)
+                return cached_response
+        if response.status_code == 200:
+            self._store(path, url, response)
+        return response
+
+    def _load(self, path):
+        try:
+            with open(path + '.json') as entry_file:
+                return json.load(entry_file)
+        except (IOError, ValueError):
+            return None
+
+    def _to_response(self, entry, path):
+        response = Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = entry['url']
+        response.encoding = entry['encoding']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        with open(path + '.body', 'rb') as body_file:
+            response._content = body_file.read()
+        return response
+
+    def _store(self, path, url, response):
+        entry = {
+            'url': url,
+            'stored': time.time(),
+            'encoding': response.encoding,
+            'headers': dict((name, response.headers[name]) for name in _HEADERS_TO_STORE
+                            if name in response.headers),
+        }
+        _write_atomically(path + '.body', response.content)
+        self._store_entry(path, entry)
+        self._evict()
+
+    def _store_entry(self, path, entry):
+        _write_atomically(path + '.json', json.dumps(entry).encode('utf-8'))
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self._directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self._directory, name[:-len('.json')])
+            try:
+                size = os.path.getsize(path + '.json') + os.path.getsize(path + '.body')
+                entries.append((os.path.getmtime(path + '.json'), size, path))
+            except OSError:
+                continue
+            total_size += size
+        entries.sort()
+        for accessed, size, path in entries:
+            if total_size <= self._max_size:
+                break
+            for suffix in ('.json', '.body'):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            total_size -= size
+
+
+def _write_atomically(path, content):
+    temp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'wb') as temp_file:
+        temp_file.write(content)
+    os.replace(temp_path, path)
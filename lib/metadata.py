@@ -0,0 +1,39 @@
+import threading
+import time
+import weakref
+
+# Seconds to keep the fields and projects of a JIRA client in memory, so that
+# a long-lived daemon eventually sees new custom fields and projects.
+DEFAULT_TTL = 60 * 60
+
+# Maps JIRA clients to {name: (fetched time, value)}, kept for the life of
+# each client.
+_g_metadata = weakref.WeakKeyDictionary()
+_g_metadata_lock = threading.Lock()
+
+
+def get_fields(jira, ttl=DEFAULT_TTL):
+    """
+    Returns the fields of the JIRA server as returned by jira.fields(),
+    fetched once per client and kept for ttl seconds.
+    """
+    return _get(jira, 'fields', jira.fields, ttl)
+
+
+def get_projects(jira, ttl=DEFAULT_TTL):
+    """
+    Returns the projects visible to the JIRA client as returned by
+    jira.projects(), fetched once per client and kept for ttl seconds.
+    """
+    return _get(jira, 'projects', jira.projects, ttl)
+
+
+def _get(jira, name, fetch, ttl):
+    with _g_metadata_lock:
+        fetched, value = _g_metadata.setdefault(jira, {}).get(name, (None, None))
+    if fetched is not None and time.time() - fetched < ttl:
+        return value
+    value = fetch()
+    with _g_metadata_lock:
+        _g_metadata.setdefault(jira, {})[name] = (time.time(), value)
+    return value
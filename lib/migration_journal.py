@@ -0,0 +1,47 @@
+import sqlite3
+import threading
+
+
+class MigrationJournal(object):
+    """
+    Persistent record of completed export/import steps per source issue.
+    Steps are stored in an SQLite database so that an interrupted migration
+    can be resumed where it stopped. Use ':memory:' as path for a journal
+    that lasts only for the current run.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS steps ('
+                                 'source_key TEXT NOT NULL, '
+                                 'step TEXT NOT NULL, '
+                                 'value TEXT NOT NULL, '
+                                 'PRIMARY KEY (source_key, step))')
+        self._connection.commit()
+        self._steps = {}
+        for source_key, step, value in self._connection.execute(
+                'SELECT source_key, step, value FROM steps'):
+            self._steps.setdefault(source_key, {})[step] = value
+
+    def __len__(self):
+        return len(self._steps)
+
+    def get(self, source_key, step):
+        """Returns the value recorded for the step or None if the step has not been completed."""
+        return self._steps.get(source_key, {}).get(step)
+
+    def has(self, source_key, step):
+        return self.get(source_key, step) is not None
+
+    def record(self, source_key, step, value=''):
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO steps VALUES (?, ?, ?)',
+                                     (source_key, step, value))
+            self._connection.commit()
+            self._steps.setdefault(source_key, {})[step] = value
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
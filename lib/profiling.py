@@ -0,0 +1,187 @@
+from __future__ import print_function
+
+import collections
+import json
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from . import throttling
+
+_ISSUE_KEY_REGEX = re.compile(r'/[A-Z][A-Z0-9_]*-\d+(?=/|$)')
+_ID_REGEX = re.compile(r'(?<!/api)/\d+(?=/|$)')
+# Attachment content URLs end with the file name.
+_ATTACHMENT_FILE_REGEX = re.compile(r'(/secure/attachment/\{id\})/.*')
+
+
+class Profiler(object):
+    """
+    Records the HTTP requests sent by the instrumented JIRA sessions per
+    endpoint and per phase: call counts, latencies, request and response
+    bytes, errors and retries made by the retry layer in lib.throttling.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = collections.defaultdict(_Stats)
+        self._phases = collections.defaultdict(_Stats)
+        self._started = time.monotonic()
+
+    def record(self, endpoint, phase, seconds, request_bytes, response_bytes, error, retry):
+        with self._lock:
+            for stats in (self._endpoints[endpoint], self._phases[phase or 'other']):
+                stats.add(seconds, request_bytes, response_bytes, error, retry)
+
+    def summary(self):
+        """Returns the recorded statistics as a JSON-serializable dict."""
+        with self._lock:
+            endpoints = dict((endpoint, stats.summary())
+                             for endpoint, stats in self._endpoints.items())
+            phases = dict((phase, stats.summary()) for phase, stats in self._phases.items())
+        return {
+            'wall seconds': round(time.monotonic() - self._started, 3),
+            'calls': sum(stats['calls'] for stats in endpoints.values()),
+            'endpoints': endpoints,
+            'phases': phases,
+        }
+
+    def print_report(self, file=None, json_file=None):
+        """Prints a table per endpoint and phase and writes the JSON summary to json_file."""
+        file = file or sys.stderr
+        summary = self.summary()
+        if json_file:
+            with open(json_file, 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+        print('\nProfile: {calls} HTTP calls in {wall seconds:.2f}s'.format(**summary), file=file)
+        for title, rows in (('endpoint', summary['endpoints']), ('phase', summary['phases'])):
+            if title == 'phase' and list(rows) == ['other']:
+                continue
+            print(file=file)
+            print('%-50s %6s %8s %8s %8s %10s %10s %7s %6s' % (title, 'calls', 'p50 ms',
+                    'p95 ms', 'max ms', 'sent', 'received', 'retries', 'errors'), file=file)
+            for name, stats in sorted(rows.items(), key=lambda row: -row[1]['total seconds']):
+                print('%-50s %6d %8.0f %8.0f %8.0f %10d %10d %7d %6d' % (name, stats['calls'],
+                        stats['p50'] * 1000, stats['p95'] * 1000, stats['max'] * 1000,
+                        stats['request bytes'], stats['response bytes'], stats['retries'],
+                        stats['errors']), file=file)
+
+
+class _Stats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.errors = 0
+        self.retries = 0
+
+    def add(self, seconds, request_bytes, response_bytes, error, retry):
+        self.latencies.append(seconds)
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        self.errors += error
+        self.retries += retry
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            'calls': len(latencies),
+            'total seconds': round(sum(latencies), 3),
+            'p50': round(_percentile(latencies, 50), 4),
+            'p95': round(_percentile(latencies, 95), 4),
+            'max': round(latencies[-1], 4),
+            'request bytes': self.request_bytes,
+            'response bytes': self.response_bytes,
+            'retries': self.retries,
+            'errors': self.errors,
+        }
+
+
+def _percentile(sorted_values, percent):
+    # Nearest-rank percentile.
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[int(index)]
+
+
+_g_profiler = None
+
+def start():
+    """Starts recording the requests of all instrumented sessions."""
+    global _g_profiler
+    _g_profiler = Profiler()
+    return _g_profiler
+
+
+def stop():
+    global _g_profiler
+    profiler, _g_profiler = _g_profiler, None
+    return profiler
+
+
+_g_phase = threading.local()
+
+@contextmanager
+def phase(name):
+    """Attributes the requests that the current thread sends in the block to the phase."""
+    previous = getattr(_g_phase, 'name', None)
+    _g_phase.name = name
+    try:
+        yield
+    finally:
+        _g_phase.name = previous
+
+
+def install(session):
+    """
+    Instruments the given JIRA session. Every HTTP request it sends,
+    including each retry, is recorded while a profiler is started.
+    """
+    if getattr(session, '_profiled', False):
+        return
+    send = session.send
+
+    def profiled_send(request, **kwargs):
+        profiler = _g_profiler
+        if profiler is None:
+            return send(request, **kwargs)
+        start_time = time.monotonic()
+        response = None
+        try:
+            response = send(request, **kwargs)
+            return response
+        finally:
+            profiler.record(_get_endpoint(request), getattr(_g_phase, 'name', None),
+                            time.monotonic() - start_time, _get_request_size(request),
+                            _get_response_size(response, kwargs.get('stream')),
+                            response is None or response.status_code >= 400,
+                            throttling.current_attempt() > 0)
+
+    session.send = profiled_send
+    session._profiled = True
+
+
+def _get_endpoint(request):
+    path = request.path_url.split('?', 1)[0]
+    path = _ISSUE_KEY_REGEX.sub('/{key}', path)
+    path = _ID_REGEX.sub('/{id}', path)
+    path = _ATTACHMENT_FILE_REGEX.sub(r'\1/{filename}', path)
+    return '{} {}'.format(request.method, path)
+
+
+def _get_request_size(request):
+    if 'Content-Length' in request.headers:
+        return int(request.headers['Content-Length'])
+    if isinstance(request.body, (bytes, str)):
+        return len(request.body)
+    return 0
+
+
+def _get_response_size(response, stream):
+    if response is None:
+        return 0
+    # Reading the content of streamed responses would load them into memory.
+    if stream:
+        return int(response.headers.get('Content-Length', 0))
+    return len(response.content)
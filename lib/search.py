@@ -0,0 +1,42 @@
+from . import metadata
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def search_issue_pages(jira, query, fields=None, expand=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Yields pages of issues that match the given JQL query until the whole
+    result set has been fetched. The total result count is available in the
+    ``total`` attribute of each page.
+    """
+    start_at = 0
+    while True:
+        page = jira.search_issues(query, startAt=start_at, maxResults=page_size,
+                                  fields=fields, expand=expand)
+        if not page:
+            return
+        yield page
+        start_at += len(page)
+        if start_at >= page.total:
+            return
+
+
+def iter_issues(jira, query, fields=None, expand=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Yields all issues that match the given JQL query, fetching them one page
+    at a time.
+    """
+    for page in search_issue_pages(jira, query, fields, expand, page_size):
+        for issue in page:
+            yield issue
+
+
+def get_field_id(jira, name):
+    """
+    Returns the ID of the field with the given name, e.g. the ID of the
+    'Epic Link' custom field. The fields are fetched once per client.
+    """
+    for field in metadata.get_fields(jira):
+        if field['name'] == name:
+            return field['id']
+    raise RuntimeError("Field '%s' not found" % name)
@@ -1,19 +1,99 @@
 from __future__ import unicode_literals
 
-def list_epics_stories_and_tasks(jira, query):
-    result = []
-    epics = jira.search_issues(query, maxResults=1000,
-            fields="summary,description")
-    for epic in epics:
-        result.append(_to_string(epic))
-        stories = jira.search_issues('"Epic Link" = %s' % epic.key)
-        for story in stories:
-            result.append(_to_string(story, 1))
-            tasks = jira.search_issues('parent = %s' % story.key)
-            for task in tasks:
-                result.append(_to_string(task, 2))
+import collections
+import itertools
+import json
+
+from . import fanout
+from . import search
+
+# Number of parent issue keys in a single child issue query.
+PARENT_CHUNK_SIZE = 50
+
+FORMATS = ('markdown', 'json', 'ndjson')
+
+def list_epics_stories_and_tasks(jira, query, concurrency=fanout.DEFAULT_CONCURRENCY,
+        format='markdown'):
+    """
+    Yields the tree of epics that match the query with their stories and
+    the subtasks of the stories as soon as each epic subtree is complete,
+    as a Markdown list, a JSON array or one JSON object per line.
+    """
+    epic_link_field = search.get_field_id(jira, 'Epic Link')
+    trees = _iter_epic_trees(jira, query, epic_link_field, concurrency)
+    if format == 'markdown':
+        for epic, stories in trees:
+            yield _to_markdown(epic, stories)
+    elif format == 'ndjson':
+        for epic, stories in trees:
+            yield json.dumps(_to_dict(epic, stories))
+    elif format == 'json':
+        separator = '['
+        for epic, stories in trees:
+            yield separator + json.dumps(_to_dict(epic, stories))
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+    else:
+        raise ValueError("Unknown format '%s', use one of %s" % (format, ', '.join(FORMATS)))
+
+def _iter_epic_trees(jira, query, epic_link_field, concurrency):
+    # The first epic is fetched alone to print it as soon as possible, the
+    # subtrees of the following chunks of epics are fetched concurrently
+    # and yielded in order.
+    epics = fanout.iter_issues(jira, query, fields="summary,description",
+            concurrency=concurrency)
+    chunks = itertools.chain([list(itertools.islice(epics, 1))],
+            iter(lambda: list(itertools.islice(epics, PARENT_CHUNK_SIZE)), []))
+    def fetch_subtrees(epic_chunk):
+        return lambda: _get_subtrees(jira, epic_chunk, epic_link_field)
+    for subtrees in fanout.iter_concurrently(
+            (fetch_subtrees(chunk) for chunk in chunks if chunk), concurrency):
+        for subtree in subtrees:
+            yield subtree
+
+def _get_subtrees(jira, epics, epic_link_field):
+    stories = _get_children(jira, '"Epic Link"', epics, epic_link_field,
+            lambda story: getattr(story.fields, epic_link_field))
+    tasks = _get_children(jira, 'parent',
+            [story for epic in epics for story in stories[epic.key]], 'parent',
+            lambda task: task.fields.parent.key)
+    return [(epic, [(story, tasks[story.key]) for story in stories[epic.key]])
+            for epic in epics]
+
+def _get_children(jira, link_name, parents, link_field, get_parent_key):
+    children = collections.defaultdict(list)
+    for start in range(0, len(parents), PARENT_CHUNK_SIZE):
+        chunk = parents[start:start + PARENT_CHUNK_SIZE]
+        query = '%s in (%s)' % (link_name, ','.join(parent.key for parent in chunk))
+        for child in search.iter_issues(jira, query,
+                fields="summary,description," + link_field):
+            children[get_parent_key(child)].append(child)
+    return children
+
+def _to_markdown(epic, stories):
+    result = [_to_string(epic)]
+    for story, tasks in stories:
+        result.append(_to_string(story, 1))
+        for task in tasks:
+            result.append(_to_string(task, 2))
     return '\n'.join(result)
 
+def _to_dict(epic, stories):
+    result = _issue_to_dict(epic)
+    for story, tasks in stories:
+        story_dict = _issue_to_dict(story)
+        story_dict['children'].extend(_issue_to_dict(task) for task in tasks)
+        result['children'].append(story_dict)
+    return result
+
+def _issue_to_dict(issue):
+    return {
+        'key': issue.key,
+        'summary': issue.fields.summary,
+        'description': issue.fields.description,
+        'children': [],
+    }
+
 def _to_string(issue, level=0):
     offset = level * '    '
     result = '{0}* {1.key}: {1.fields.summary}'
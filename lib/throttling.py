@@ -0,0 +1,184 @@
+import random
+import threading
+import time
+
+from jira.exceptions import JIRAError
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+THROTTLED_STATUSES = (429, 503)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE_DELAY = 1.0
+BACKOFF_MAX_DELAY = 60.0
+
+
+class RateLimiter(object):
+    """
+    Adaptive token bucket that limits the request rate to a JIRA server.
+    The rate is halved every time the server signals overload with 429 or
+    503 responses and recovers gradually up to the configured maximum while
+    requests succeed. Retry-After pauses all requests to the server.
+    """
+
+    def __init__(self, requests_per_second):
+        self._max_rate = float(requests_per_second)
+        self._min_rate = min(1.0, self._max_rate)
+        self._rate = self._max_rate
+        self._capacity = max(1.0, self._max_rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity,
+                                   self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = max(self._paused_until - now, (1 - self._tokens) / self._rate)
+            time.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self._rate = min(self._max_rate, self._rate + self._max_rate / 20)
+
+    def on_throttled(self, retry_after=None):
+        with self._lock:
+            self._rate = max(self._min_rate, self._rate / 2)
+            self._tokens = min(self._tokens, 0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+# Rate limiters are shared by all clients of the same server.
+_g_limiters = {}
+_g_limiters_lock = threading.Lock()
+
+def get_rate_limiter(server, requests_per_second):
+    with _g_limiters_lock:
+        if server not in _g_limiters:
+            _g_limiters[server] = RateLimiter(requests_per_second)
+        return _g_limiters[server]
+
+
+def configure(jira, jira_conf, pool_size=None):
+    """
+    Installs the shared rate limiter and retry layer for the server in the
+    given JIRA client if 'requests-per-second' is set in the JIRA server
+    configuration, and sizes its connection pool.
+    """
+    if pool_size:
+        set_pool_size(jira._session, pool_size)
+    if not jira_conf.get('requests-per-second'):
+        return
+    limiter = get_rate_limiter(jira_conf['server'], jira_conf['requests-per-second'])
+    install(jira._session, limiter, jira_conf.get('max-retries', DEFAULT_MAX_RETRIES))
+
+
+def install(session, limiter, max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Sends all requests of the given JIRA session through the rate limiter.
+    Requests rejected with 429 are retried, idempotent requests are also
+    retried after 502, 503, 504 and connection errors, with jittered
+    exponential backoff or the delay from Retry-After. Requests with a
+    stream body are retried only if the JIRA client can recreate it.
+    """
+    request = session.request
+    # The retry layer replaces the retries of the JIRA session.
+    session.max_retries = 0
+
+    def throttled_request(method, url, **kwargs):
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        try:
+            while True:
+                limiter.acquire()
+                _g_attempt.value = attempt
+                try:
+                    response = request(method, url, **kwargs)
+                except JIRAError as e:
+                    status = e.status_code
+                    retry_after = _get_retry_after(e.response)
+                    if status in THROTTLED_STATUSES:
+                        limiter.on_throttled(retry_after)
+                    retryable = status == 429 or (idempotent and status in RETRY_STATUSES)
+                    if not retryable or attempt >= max_retries or not _can_resend(kwargs):
+                        raise
+                except (ConnectionError, Timeout):
+                    retry_after = None
+                    if not idempotent or attempt >= max_retries or not _can_resend(kwargs):
+                        raise
+                else:
+                    limiter.on_success()
+                    return response
+                time.sleep(retry_after if retry_after is not None else _get_backoff_delay(attempt))
+                attempt += 1
+                # Streamed bodies like attachment uploads have been read
+                # and are recreated by the JIRA client for the retry.
+                if kwargs.get('_prepare_retry_class') is not None:
+                    kwargs = kwargs['_prepare_retry_class'].prepare(kwargs)
+        finally:
+            _g_attempt.value = 0
+
+    session.request = throttled_request
+
+
+# Number of the current attempt of the request that the thread is sending,
+# 0 for the first attempt.
+_g_attempt = threading.local()
+
+def current_attempt():
+    return getattr(_g_attempt, 'value', 0)
+
+
+def set_pool_size(session, pool_size):
+    """
+    Sizes the connection pool so that concurrent requests can reuse
+    connections. Pools that are large enough are kept with their open
+    connections, replaced pools are closed.
+    """
+    pool_size = max(pool_size, DEFAULT_POOLSIZE)
+    adapters = [session.adapters.get(prefix) for prefix in ('https://', 'http://')]
+    if all(getattr(adapter, '_pool_maxsize', 0) >= pool_size for adapter in adapters):
+        return
+    adapter = HTTPAdapter(pool_connections=DEFAULT_POOLSIZE, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    for replaced in set(adapters):
+        if replaced is not None:
+            replaced.close()
+
+
+def _can_resend(kwargs):
+    # A stream or file body can be sent again only when the JIRA client
+    # passes a way to recreate it.
+    data = kwargs.get('data')
+    if data is None or isinstance(data, (bytes, str, dict, list, tuple)):
+        return True
+    return kwargs.get('_prepare_retry_class') is not None
+
+
+def _get_backoff_delay(attempt):
+    delay = min(BACKOFF_MAX_DELAY, BACKOFF_BASE_DELAY * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _get_retry_after(response):
+    if response is None:
+        return None
+    try:
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
@@ -1,21 +1,88 @@
+import re
+
+from . import fanout
+from . import search
 from .workdays import WorkdaysFromSeconds
 
+TIMETRACKING_FIELDS = (
+    ("original estimate", "aggregatetimeoriginalestimate"),
+    ("time spent", "aggregatetimespent"),
+    ("time remaining", "aggregatetimeestimate"),
+)
+
+GROUP_BY_CHOICES = ('assignee', 'epic', 'component', 'sprint')
+
+# The maximum page size that JIRA allows by default.
+PAGE_SIZE = 1000
+
+
+def sum_timetracking_for_jql(jira, query, group_by=None,
+                             concurrency=fanout.DEFAULT_CONCURRENCY):
+    """
+    Sums time tracking fields of all issues that match the query, one page
+    of issues at a time with up to concurrency pages fetched in parallel.
+    If group_by is given, returns the sums per assignee, epic, component or
+    sprint. Issues that belong to several components or sprints are
+    included in the sums of each of them.
+    """
+    fields = [field for name, field in TIMETRACKING_FIELDS]
+    group_field = None
+    if group_by:
+        group_field = _get_group_by_field(jira, group_by)
+        fields.append(group_field)
+    totals = {}
+    for issue in fanout.iter_issues(jira, query, fields=','.join(fields),
+                                    page_size=PAGE_SIZE, concurrency=concurrency):
+        groups = _get_groups(issue, group_by, group_field) if group_by else (None,)
+        for group in groups:
+            group_totals = totals.setdefault(group, [0] * len(TIMETRACKING_FIELDS))
+            for i, (name, field) in enumerate(TIMETRACKING_FIELDS):
+                group_totals[i] += getattr(issue.fields, field) or 0
+    if not group_by:
+        return _to_workdays(totals.get(None, [0] * len(TIMETRACKING_FIELDS)))
+    return dict((group, _to_workdays(group_totals))
+                for group, group_totals in totals.items())
+
+
+def _to_workdays(totals):
+    return dict((name, WorkdaysFromSeconds(total))
+                for (name, field), total in zip(TIMETRACKING_FIELDS, totals))
+
+
+def _get_group_by_field(jira, group_by):
+    if group_by == 'assignee':
+        return 'assignee'
+    if group_by == 'component':
+        return 'components'
+    if group_by == 'epic':
+        return search.get_field_id(jira, 'Epic Link')
+    if group_by == 'sprint':
+        return search.get_field_id(jira, 'Sprint')
+    raise ValueError("Cannot group by '%s', use one of %s" %
+                     (group_by, ', '.join(GROUP_BY_CHOICES)))
+
+
+SPRINT_NAME_REGEX = re.compile(r'name=([^,\]]*)')
+
 
-def sum_timetracking_for_jql(jira, query):
-    issues = jira.search_issues(query,
-                                maxResults=1000,
-                                fields="aggregatetimeestimate,aggregatetimespent,aggregatetimeoriginalestimate")
-    total_planned = sum(issue.fields.aggregatetimeoriginalestimate
-                        if issue.fields.aggregatetimeoriginalestimate else 0
-                        for issue in issues)
-    total_spent = sum(issue.fields.aggregatetimespent
-                      if issue.fields.aggregatetimespent else 0
-                      for issue in issues)
-    total_remaining = sum(issue.fields.aggregatetimeestimate
-                          if issue.fields.aggregatetimeestimate else 0
-                          for issue in issues)
-    return {
-        "original estimate": WorkdaysFromSeconds(total_planned),
-        "time spent": WorkdaysFromSeconds(total_spent),
-        "time remaining": WorkdaysFromSeconds(total_remaining),
-    }
+def _get_groups(issue, group_by, group_field):
+    value = getattr(issue.fields, group_field, None)
+    if group_by == 'assignee':
+        return (value.displayName if value else '(unassigned)',)
+    if group_by == 'epic':
+        return (value or '(no epic)',)
+    if group_by == 'component':
+        return [component.name for component in value] if value else ('(no component)',)
+    # Sprints are objects in JIRA Cloud and strings like
+    # 'com.atlassian.greenhopper.service.sprint.Sprint@1f[id=1,...,name=Sprint 1,...]'
+    # in JIRA Server.
+    if not value:
+        return ('(no sprint)',)
+    sprints = []
+    for sprint in value:
+        if hasattr(sprint, 'name'):
+            sprints.append(sprint.name)
+        else:
+            match = SPRINT_NAME_REGEX.search(sprint)
+            sprints.append(match.group(1) if match else sprint)
+    return sprints
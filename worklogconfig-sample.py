@@ -11,4 +11,10 @@ CREDENTIAL_DIR = os.path.join(HOME_DIR, '.credentials')
 CREDENTIAL_FILE = os.path.join(CREDENTIAL_DIR, 'ask-jira.json')
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 CLIENT_SECRET_FILE = os.path.join(CREDENTIAL_DIR, 'client_secret.json')
+# Calendar sync tokens of --incremental imports.
+SYNC_TOKEN_FILE = os.path.join(CREDENTIAL_DIR, 'ask-jira-sync-tokens.json')
+# Calendar IDs by name are cached for CALENDAR_ID_TTL seconds, 0 disables
+# the cache.
+CALENDAR_ID_FILE = os.path.join(CREDENTIAL_DIR, 'ask-jira-calendars.json')
+CALENDAR_ID_TTL = 24 * 60 * 60
 APPLICATION_NAME = 'Ask JIRA'